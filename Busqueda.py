@@ -0,0 +1,171 @@
+import re
+import unicodedata
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.collection import Collection
+
+# Campo donde cada documento guarda sus palabras normalizadas (minúsculas y sin tildes).
+# Tiene un índice multikey, así que una búsqueda por prefijo "^pal" usa el índice.
+CAMPO = "_busqueda"
+TAM_PAGINA = 50
+
+
+def normalizar(texto) -> str:
+    texto = unicodedata.normalize("NFKD", str(texto))
+    return "".join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def palabras(texto) -> list[str]:
+    return re.findall(r"\w+", normalizar(texto))
+
+
+def claves_busqueda(doc: dict, campos: list[str]) -> list[str]:
+    claves = set()
+    for campo in campos:
+        valor = doc.get(campo)
+        if valor is not None:
+            claves.update(palabras(valor))
+    return sorted(claves)
+
+
+def leer_token(token: str):
+    """El token es "_id" en los listados sin búsqueda y "puntaje:_id" en las búsquedas."""
+    if not token:
+        return None, None
+    if ":" in token:
+        puntaje, ultimo = token.split(":", 1)
+        return int(puntaje), ObjectId(ultimo)
+    return None, ObjectId(token)
+
+
+def paginar(docs: list, limite: int, token):
+    # Se pide un documento de más para saber si hay otra página sin contar
+    if limite and len(docs) > limite:
+        docs = docs[:limite]
+        return docs, token(docs[-1])
+    return docs, None
+
+
+def filtro_busqueda(prompt: str):
+    # Cada palabra del prompt debe ser prefijo de alguna clave del documento
+    terminos = palabras(prompt)
+    if not terminos:
+        return {}
+    return {"$and": [{CAMPO: {"$regex": "^" + re.escape(t)}} for t in terminos]}
+
+
+def coincide(doc: dict, prompt: str) -> bool:
+    # Lo mismo que filtro_busqueda, pero sobre un documento que ya está en memoria
+    claves = doc.get(CAMPO) or []
+    return all(any(c.startswith(t) for c in claves) for t in palabras(prompt))
+
+
+def filtro_en_memoria(prompt: str):
+    """Para las vistas: None sin búsqueda, o una función doc -> bool con el mismo criterio."""
+    if not palabras(prompt):
+        return None
+    return lambda doc: coincide(doc, prompt)
+
+
+def proyectar(proyeccion: dict = None, extra: dict = None):
+    """Completa la proyección pedida por una vista. Si es de inclusión ({"nombre": 1})
+    el campo de búsqueda ya queda afuera; si es de exclusión se le agrega."""
+    if not proyeccion:
+        return {CAMPO: 0}
+    if any(v for k, v in proyeccion.items() if k != "_id"):
+        return {**proyeccion, **(extra or {})}
+    return {**proyeccion, CAMPO: 0}
+
+
+def consulta(prompt: str, despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+    """Arma el pipeline de búsqueda. Los resultados se ordenan por cantidad de palabras
+    que coinciden completas."""
+    terminos = palabras(prompt)
+    pipeline = [
+        {"$match": filtro_busqueda(prompt)},
+        {"$addFields": {"_puntaje": {"$size": {
+            "$filter": {"input": f"${CAMPO}", "cond": {"$in": ["$$this", terminos]}}
+        }}}},
+    ]
+    puntaje, ultimo = leer_token(despues)
+    if ultimo is not None:
+        pipeline.append({"$match": {"$or": [
+            {"_puntaje": {"$lt": puntaje}},
+            {"_puntaje": puntaje, "_id": {"$lt": ultimo}},
+        ]}})
+    pipeline.append({"$sort": {"_puntaje": -1, "_id": -1}})
+    if limite:
+        pipeline.append({"$limit": limite + 1})
+    # El puntaje se necesita para armar el token; pagina_busqueda lo quita
+    pipeline.append({"$project": proyectar(proyeccion, {"_puntaje": 1})})
+    return pipeline
+
+
+def listado(coleccion, despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+    # Cursor del listado sin búsqueda; sirve igual para la colección síncrona y la async
+    _, ultimo = leer_token(despues)
+    filtro = {"_id": {"$lt": ultimo}} if ultimo is not None else {}
+    return coleccion.find(filtro, proyectar(proyeccion)).sort("_id", -1).limit(limite + 1 if limite else 0)
+
+
+def pagina_listado(docs: list, limite: int):
+    return paginar(docs, limite, lambda d: str(d["_id"]))
+
+
+def pagina_busqueda(docs: list, limite: int):
+    pagina, token = paginar(docs, limite, lambda d: f"{d['_puntaje']}:{d['_id']}")
+    for doc in pagina:
+        doc.pop("_puntaje", None)
+    return pagina, token
+
+
+def buscar_documentos(coleccion: Collection, prompt: str = "", despues: str = None, limite: int = TAM_PAGINA,
+                      proyeccion: dict = None):
+    """Devuelve (pagina, token). Pasar el token como `despues` trae la página siguiente;
+    es None cuando no hay más. Con limite=None se traen todos los resultados.
+    `proyeccion` limita los campos que viajan desde la base."""
+    if not palabras(prompt):
+        return pagina_listado(list(listado(coleccion, despues, limite, proyeccion)), limite)
+    docs = list(coleccion.aggregate(consulta(prompt, despues, limite, proyeccion)))
+    return pagina_busqueda(docs, limite)
+
+
+async def buscar_documentos_async(coleccion: AsyncCollection, prompt: str = "", despues: str = None,
+                                  limite: int = TAM_PAGINA, proyeccion: dict = None):
+    if not palabras(prompt):
+        return pagina_listado(await listado(coleccion, despues, limite, proyeccion).to_list(), limite)
+    cursor = await coleccion.aggregate(consulta(prompt, despues, limite, proyeccion))
+    return pagina_busqueda(await cursor.to_list(), limite)
+
+
+def actualizar_claves(coleccion: Collection, _id: ObjectId, data: dict, campos: list[str], extra: dict = None):
+    """find_one_and_update de `data` que deja CAMPO al día en la misma escritura. Devuelve el
+    documento actualizado, o None si no existe. `extra` se suma al update (por ejemplo SELLO).
+
+    Si cambia algún campo de búsqueda, las claves se arman con el documento leído más `data`,
+    y el filtro exige que esos campos sigan como se leyeron: si otro los cambió en el medio,
+    no se escribe nada y se vuelve a leer."""
+    actualizacion = {"$set": dict(data), **(extra or {})}
+    if not set(data) & set(campos):
+        return coleccion.find_one_and_update({"_id": _id}, actualizacion, return_document=ReturnDocument.AFTER)
+    while True:
+        actual = coleccion.find_one({"_id": _id}, {c: 1 for c in campos})
+        if actual is None:
+            return None
+        actualizacion["$set"][CAMPO] = claves_busqueda({**actual, **data}, campos)
+        filtro = {"_id": _id, **{c: actual.get(c) for c in campos}}
+        doc = coleccion.find_one_and_update(filtro, actualizacion, return_document=ReturnDocument.AFTER)
+        if doc is not None:
+            return doc
+
+
+def reconstruir(coleccion: Collection, campos: list[str], lote: int = 1000):
+    operaciones = []
+    for doc in coleccion.find({}, {c: 1 for c in campos}):
+        operaciones.append(UpdateOne({"_id": doc["_id"]}, {"$set": {CAMPO: claves_busqueda(doc, campos)}}))
+        if len(operaciones) >= lote:
+            coleccion.bulk_write(operaciones, ordered=False)
+            operaciones = []
+    if operaciones:
+        coleccion.bulk_write(operaciones, ordered=False)
@@ -0,0 +1,257 @@
+import copy
+import functools
+import inspect
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from dotenv import load_dotenv
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+load_dotenv()
+
+TTL = float(os.getenv("CACHE_TTL", "300"))
+MAXIMO = int(os.getenv("CACHE_MAXIMO", "512"))
+# Con varios procesos (Trabajadores.py) se comparte la caché por Redis, p. ej. redis://localhost:6379/0
+REDIS_URL = os.getenv("CACHE_REDIS_URL", "")
+PREFIJO = os.getenv("CACHE_REDIS_PREFIJO", "veterinaria")
+
+
+class CacheTTL:
+    """Cache LRU con vencimiento. Cada entrada lleva etiquetas para invalidarla
+    justo cuando cambia el dato del que depende."""
+
+    def __init__(self, ttl: float = TTL, maximo: int = MAXIMO):
+
+        self.ttl = ttl
+        self.maximo = maximo
+        self.datos = OrderedDict()
+        self.etiquetas = defaultdict(set)
+        # Cuántas veces se invalidó cada etiqueta; sirve de sello para lo que se guarda afuera
+        # de esta caché (por ejemplo, las vistas de cada sesión)
+        self.versiones = defaultdict(int)
+        self.generacion = 0
+        self.lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self.lock:
+            entrada = self.datos.get(clave)
+            if entrada is None:
+                return False, None
+            vence, valor, _ = entrada
+            if vence < time.monotonic():
+                self._quitar(clave)
+                return False, None
+            self.datos.move_to_end(clave)
+            return True, copy.copy(valor)
+
+    def guardar(self, clave, valor, etiquetas=(), ttl: float = None):
+        with self.lock:
+            self._quitar(clave)
+            self.datos[clave] = (time.monotonic() + (ttl or self.ttl), copy.copy(valor), tuple(etiquetas))
+            for etiqueta in etiquetas:
+                self.etiquetas[etiqueta].add(clave)
+            while len(self.datos) > self.maximo:
+                self._quitar(next(iter(self.datos)))
+
+    def _quitar(self, clave):
+        entrada = self.datos.pop(clave, None)
+        if entrada is None:
+            return
+        for etiqueta in entrada[2]:
+            claves = self.etiquetas.get(etiqueta)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self.etiquetas[etiqueta]
+
+    def invalidar(self, *etiquetas):
+        with self.lock:
+            for etiqueta in etiquetas:
+                self.versiones[etiqueta] += 1
+                for clave in list(self.etiquetas.get(etiqueta, ())):
+                    self._quitar(clave)
+
+    def limpiar(self):
+        with self.lock:
+            self.datos.clear()
+            self.etiquetas.clear()
+            self.generacion += 1
+
+    def sellos(self, *etiquetas):
+        with self.lock:
+            return (self.generacion, *(self.versiones[e] for e in etiquetas))
+
+
+class CapaRedis:
+    """Segundo nivel compartido entre procesos. Guarda los valores con las mismas etiquetas
+    que la caché local y avisa por un canal pub/sub cada invalidación, para que los demás
+    procesos borren sus copias locales. Si Redis no responde, cada proceso sigue solo con la suya."""
+
+    def __init__(self, url: str):
+
+        self.cliente = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self.canal = f"{PREFIJO}:invalidar"
+        self.origen = uuid.uuid4().hex
+        self.caido = False
+        threading.Thread(target=self._escuchar, daemon=True, name="cache-redis").start()
+
+    def _clave(self, clave):
+        return f"{PREFIJO}:cache:{clave!r}"
+
+    def _fallo(self, e):
+        if not self.caido:
+            print("Caché compartida no disponible:", e)
+        self.caido = True
+
+    def obtener(self, clave):
+        try:
+            crudo = self.cliente.get(self._clave(clave))
+            self.caido = False
+        except redis.RedisError as e:
+            self._fallo(e)
+            return False, None
+        if crudo is None:
+            return False, None
+        return True, pickle.loads(crudo)
+
+    def guardar(self, clave, valor, etiquetas=(), ttl: float = None):
+        segundos = max(1, int(ttl or TTL))
+        nombre = self._clave(clave)
+        try:
+            with self.cliente.pipeline() as tuberia:
+                tuberia.setex(nombre, segundos, pickle.dumps(valor))
+                for etiqueta in etiquetas:
+                    tuberia.sadd(f"{PREFIJO}:etiqueta:{etiqueta}", nombre)
+                    tuberia.expire(f"{PREFIJO}:etiqueta:{etiqueta}", segundos)
+                tuberia.execute()
+        except redis.RedisError as e:
+            self._fallo(e)
+
+    def invalidar(self, *etiquetas):
+        try:
+            for etiqueta in etiquetas:
+                conjunto = f"{PREFIJO}:etiqueta:{etiqueta}"
+                claves = self.cliente.smembers(conjunto)
+                self.cliente.delete(conjunto, *claves)
+            self.cliente.publish(self.canal, json.dumps({"origen": self.origen, "etiquetas": list(etiquetas)}))
+        except redis.RedisError as e:
+            self._fallo(e)
+
+    def _escuchar(self):
+        while True:
+            try:
+                suscripcion = self.cliente.pubsub(ignore_subscribe_messages=True)
+                suscripcion.subscribe(self.canal)
+                for mensaje in suscripcion.listen():
+                    aviso = json.loads(mensaje["data"])
+                    if aviso["origen"] != self.origen:
+                        _aplicar(aviso["etiquetas"])
+            except redis.RedisError as e:
+                self._fallo(e)
+                # Lo que se invalidó mientras no había conexión pudo perderse
+                cache.limpiar()
+                time.sleep(5)
+
+
+cache = CacheTTL()
+compartida = None
+oyentes = []
+
+if REDIS_URL:
+    if redis is None:
+        print("CACHE_REDIS_URL está definido pero falta el paquete redis (pip install redis); se usa solo la caché local")
+    else:
+        compartida = CapaRedis(REDIS_URL)
+
+
+def sellos(*etiquetas):
+    """Versión actual de esas etiquetas. Si cambia, algo que dependía de ellas quedó viejo."""
+    return cache.sellos(*etiquetas)
+
+
+def al_invalidar(funcion):
+    """Registra una función que recibe las etiquetas invalidadas por otros procesos."""
+    oyentes.append(funcion)
+    return funcion
+
+
+def _aplicar(etiquetas):
+    cache.invalidar(*etiquetas)
+    for oyente in oyentes:
+        try:
+            oyente(etiquetas)
+        except Exception as e:
+            print("Error aplicando invalidación remota:", e)
+
+
+def invalidar(*etiquetas):
+    cache.invalidar(*etiquetas)
+    if compartida is not None:
+        compartida.invalidar(*etiquetas)
+
+
+def _obtener(clave, etiquetas):
+    encontrado, valor = cache.obtener(clave)
+    if encontrado or compartida is None:
+        return encontrado, valor
+    encontrado, valor = compartida.obtener(clave)
+    if encontrado:
+        cache.guardar(clave, valor, etiquetas)
+    return encontrado, valor
+
+
+def _guardar(clave, valor, etiquetas, ttl, sello):
+    # Si algo se invalidó mientras se consultaba, el valor ya puede estar viejo: no se guarda
+    if cache.sellos(*etiquetas) != sello:
+        return
+    cache.guardar(clave, valor, etiquetas, ttl)
+    if compartida is not None:
+        compartida.guardar(clave, valor, etiquetas, ttl)
+
+
+def cacheado(*etiquetas, nombre: str = None, ttl: float = None):
+    """Decorador para listas de referencia. Las etiquetas pueden ser texto o una función
+    que recibe los mismos argumentos (por ejemplo lambda cedula: f"mascotas:{cedula}").
+    Con `nombre` la versión síncrona y la async de una consulta comparten la misma entrada."""
+
+    def decorar(funcion):
+        base = nombre or funcion.__qualname__
+
+        def clave_y_etiquetas(args, kwargs):
+            clave = (base, args, tuple(sorted(kwargs.items())))
+            return clave, [e(*args, **kwargs) if callable(e) else e for e in etiquetas]
+
+        if inspect.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura_async(*args, **kwargs):
+                clave, tags = clave_y_etiquetas(args, kwargs)
+                encontrado, valor = _obtener(clave, tags)
+                if encontrado:
+                    return valor
+                sello = cache.sellos(*tags)
+                valor = await funcion(*args, **kwargs)
+                _guardar(clave, valor, tags, ttl, sello)
+                return valor
+            return envoltura_async
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            clave, tags = clave_y_etiquetas(args, kwargs)
+            encontrado, valor = _obtener(clave, tags)
+            if encontrado:
+                return valor
+            sello = cache.sellos(*tags)
+            valor = funcion(*args, **kwargs)
+            _guardar(clave, valor, tags, ttl, sello)
+            return valor
+        return envoltura
+
+    return decorar
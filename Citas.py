@@ -4,23 +4,49 @@ from fastapi.encoders import jsonable_encoder
 from fastapi import HTTPException
 from bson import ObjectId
 from pydantic import ValidationError
-from MongoDB import db
+from MongoDB import db, db_async, SELLO, sellar
 from schemas import CitaBase, CitaUpdate
 from Empleados import EmpleadoCRUD
 from Servicios import ServicioCRUD
 from Dueño import DuenioCRUD, MascotaCRUD
 from datetime import datetime, timedelta
 from plantilla import dropdown_con_agregar
+from Resolutor import ResolutorNombres
+from Cache import invalidar
+from Instrumentacion import accion
+from Sesion import notificar_cambio
+from Busqueda import (
+    CAMPO, TAM_PAGINA, buscar_documentos, buscar_documentos_async, claves_busqueda,
+    actualizar_claves, filtro_busqueda, coincide,
+)
 
 class CitaCRUD:
     citas = db["registro_citas"]  # Asegúrate que 'db' ya esté definido correctamente
+    citas_async = db_async["registro_citas"]
+    campos_busqueda = ["veterinario", "duenio", "mascota", "estado"]
+    # Lo único que necesita la agenda para ubicar y rotular cada cita
+    proyeccion_agenda = {"fechaInicio": 1, "duracion": 1, "duenio": 1, "mascota": 1, "veterinario": 1}
+    referencias = {"duenio": "duenios", "mascota": "mascotas"}
 
     @staticmethod
-    def crear(cita: CitaBase):
+    def documento(cita: CitaBase):
+        # El documento que guardan crear y crear_async
         data = cita.model_dump()
         data["duracion"] = int(data["duracion"])
+        data["fechaFin"] = data["fechaInicio"] + timedelta(minutes=data["duracion"])
+        data[CAMPO] = claves_busqueda(data, CitaCRUD.campos_busqueda)
+        return sellar(data)
+
+    @staticmethod
+    def creada(data: dict, _id):
+        invalidar("datos:citas")
+        return {**data, "_id": str(_id)}
+
+    @staticmethod
+    def crear(cita: CitaBase):
+        data = CitaCRUD.documento(cita)
         insertado = CitaCRUD.citas.insert_one(data)
-        return str(insertado.inserted_id)
+        return CitaCRUD.creada(data, insertado.inserted_id)
 
     @staticmethod
     def actualizar(id: str, update: CitaUpdate):
@@ -38,44 +64,82 @@ class CitaCRUD:
                 status_code=400, detail="No se proporcionaron campos para actualizar"
             )
 
-        resultado = CitaCRUD.citas.update_one({"_id": ObjectId(id)}, {"$set": data})
+        # Mover la cita o cambiarla de veterinario exige recalcular el fin y revisar choques
+        if "fechaInicio" in data or "veterinario" in data:
+            actual = CitaCRUD.citas.find_one(
+                {"_id": ObjectId(id)}, {"fechaInicio": 1, "duracion": 1, "veterinario": 1}
+            )
+            if not actual:
+                raise HTTPException(status_code=404, detail="Cita no encontrada")
+
+            inicio = data.get("fechaInicio", actual["fechaInicio"])
+            if isinstance(inicio, str):
+                inicio = datetime.fromisoformat(inicio)
+            fin = inicio + timedelta(minutes=int(actual["duracion"]))
+            veterinario = data.get("veterinario", actual["veterinario"])
+
+            if CitaCRUD.hay_conflicto(veterinario, inicio, fin, excluir_id=id):
+                raise HTTPException(
+                    status_code=409, detail="Este veterinario ya tiene una cita en ese horario."
+                )
+            data["fechaFin"] = fin
+
+        cita = actualizar_claves(CitaCRUD.citas, ObjectId(id), data, CitaCRUD.campos_busqueda, SELLO)
 
-        if resultado.matched_count == 0:
+        if cita is None:
             raise HTTPException(status_code=404, detail="Cita no encontrada")
 
-        return True
+        invalidar("datos:citas")
+        cita["_id"] = id
+        return cita
 
     @staticmethod
     def eliminar(id: str):
         if not ObjectId.is_valid(id):
             raise HTTPException(status_code=400, detail="ID inválido")
 
-        resultado = CitaCRUD.citas.delete_one({"_id": ObjectId(id)})
+        cita = CitaCRUD.citas.find_one_and_delete({"_id": ObjectId(id)}, projection={CAMPO: 0})
 
-        if resultado.deleted_count == 0:
+        if cita is None:
             raise HTTPException(status_code=404, detail="Cita no encontrada")
 
-        return True
+        invalidar("datos:citas")
+        cita["_id"] = id
+        return cita
 
     @staticmethod
-    def buscar(prompt: str = ""):
-        if not prompt.strip():
-            resultados = list(CitaCRUD.citas.find())
-        else:
-            primer_doc = CitaCRUD.citas.find_one()
-            if not primer_doc:
-                return []
-
-            regex = {"$regex": prompt, "$options": "i"}
-            condiciones = []
-            for campo in primer_doc:
-                if campo == "_id":
-                    continue
-                condiciones.append({campo: regex})
-
-            resultados = list(CitaCRUD.citas.find({"$or": condiciones}))
+    def hay_conflicto(veterinario: str, inicio: datetime, fin: datetime, excluir_id: str = None):
+        # Dos citas se cruzan si una empieza antes de que termine la otra y viceversa.
+        # Es un rango simple sobre el índice (veterinario, fechaInicio, fechaFin).
+        filtro = {
+            "veterinario": veterinario,
+            "fechaInicio": {"$lt": fin},
+            "fechaFin": {"$gt": inicio},
+        }
+        if excluir_id:
+            filtro["_id"] = {"$ne": ObjectId(excluir_id)}
+        return CitaCRUD.citas.find_one(filtro, {"_id": 1}) is not None
+
+    @staticmethod
+    def buscar(prompt: str = "", despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+        resultados, token = buscar_documentos(CitaCRUD.citas, prompt, despues, limite, proyeccion)
 
         # Procesar resultados
+        for doc in resultados:
+            doc["_id"] = str(doc["_id"])
+            doc["duenio"] = str(doc.get("duenio", ""))
+            doc["mascota"] = str(doc.get("mascota", ""))
+        return resultados, token
+
+    @staticmethod
+    def buscar_semana(veterinario: str, lunes: datetime, busqueda: str = ""):
+        # Rango [lunes, sábado) sobre el índice (veterinario, fechaInicio)
+        filtro = {
+            "veterinario": veterinario,
+            "fechaInicio": {"$gte": lunes, "$lt": lunes + timedelta(days=5)},
+            **filtro_busqueda(busqueda),
+        }
+        resultados = list(CitaCRUD.citas.find(filtro, CitaCRUD.proyeccion_agenda))
         for doc in resultados:
             doc["_id"] = str(doc["_id"])
             doc["duenio"] = str(doc.get("duenio", ""))
@@ -83,9 +147,10 @@ class CitaCRUD:
         return resultados
 
     @staticmethod
+    @accion("abrir detalle de cita")
     def MostrarDetalladoView(id_cita, page):
 
-        cita = CitaCRUD.citas.find_one({"_id": ObjectId(id_cita)})
+        cita = CitaCRUD.citas.find_one({"_id": ObjectId(id_cita)}, {CAMPO: 0})
         if not cita:
             page.dialog = ft.AlertDialog(title=ft.Text("Cita no encontrada"))
             page.open(page.dialog)
@@ -151,27 +216,30 @@ class CitaCRUD:
                 nueva_fecha = datetime.strptime(
                     f"{fecha_text.value} {hora_text.value}", "%Y-%m-%d %H:%M"
                 )
-                CitaCRUD.citas.update_one(
-                    {"_id": ObjectId(id_cita)}, {"$set": {"fechaInicio": nueva_fecha}}
-                )
+                actualizada = CitaCRUD.actualizar(id_cita, CitaUpdate(fechaInicio=nueva_fecha))
                 error.value = "Fecha reprogramada"
                 page.update()
+                notificar_cambio(page, "citas", "actualizar", actualizada)
+            except HTTPException as ex:
+                error.value = ex.detail
+                page.update()
             except ValidationError as ve:
                 # Extrae los errores uno por uno (puede haber varios, aquí se toma el primero)
                 error.value = ve.errors()[0]["msg"]
+                page.update()
             except Exception as ex:
                 error.value = str(ex)
                 page.update()
 
         def marcar_asistencia(e):
             try:
-                CitaCRUD.citas.update_one(
-                    {"_id": ObjectId(id_cita)}, {"$set": {"estado": "asistió"}}
-                )
+                actualizada = CitaCRUD.actualizar(id_cita, CitaUpdate(estado="asistió"))
                 estado.value = "asistió"
                 page.update()
+                notificar_cambio(page, "citas", "actualizar", actualizada)
             except ValidationError as ve:
                 error.value = ve.errors()[0]["msg"]
+                page.update()
             except Exception as ex:
                 error.value = str(ex)
                 page.update()
@@ -199,7 +267,7 @@ class CitaCRUD:
             "Reg. Servicio",
             visible=fecha_fin > ahora,
             on_click=lambda e: ServicioCRUD.crearView(
-                page, cita.get("mascota"), cita.get("veterinario")
+                page, cita.get("duenio"), cita.get("veterinario")
             ),
         )
         cancelar = ft.ElevatedButton("Cancelar", on_click=cerrar)
@@ -266,22 +334,29 @@ class CitaCRUD:
         page.overlay.append(contenedor)
         page.update()
 
-    def mostrarView(busqueda, page=None):
+    def mostrarView(busqueda, page=None, veterinarios_activos=None, eventos=None, resolutor=None):
         """Muestra una agenda semanal con filtro por veterinario
 
+        Solo se consultan las citas de la semana visible del veterinario seleccionado,
+        y se vuelve a consultar únicamente al cambiar de semana o de veterinario.
+
         Args:
-            veterinarios: Lista de nombres de veterinarios
-            eventos: Lista de diccionarios con eventos
+            busqueda: Texto para filtrar las citas de la semana
             page: Objeto page de flet (opcional)
+            veterinarios_activos: Veterinarios ya consultados (opcional, lo usa mostrarView_async)
+            eventos: Citas de la semana actual del primer veterinario (opcional)
+            resolutor: ResolutorNombres con el que ya se resolvieron esos eventos (opcional)
         """
 
-        eventos = CitaCRUD.buscar(busqueda)
-        veterinarios_activos = EmpleadoCRUD.obtener_veterinarios_activos()
+        if veterinarios_activos is None:
+            veterinarios_activos = EmpleadoCRUD.obtener_veterinarios_activos()
         veterinarios = (
             veterinarios_activos if veterinarios_activos else ["Sin veterinarios"]
         )
 
         veterinario_seleccionado = veterinarios[0]
+        # Los nombres de dueños y mascotas se piden por semana completa y quedan en memoria
+        resolutor = resolutor or ResolutorNombres()
         hora_inicio = 8
         hora_fin = 16
         base_date = datetime.now()
@@ -290,20 +365,86 @@ class CitaCRUD:
         # Contenedor principal que será retornado
         contenedor_principal = ft.Column(expand=True)
         contenedor_tabla = ft.Column(spacing=0, expand=True)
+        # Bloques de las citas dibujadas, por _id, para cambiar uno sin redibujar la semana
+        stack_global = ft.Stack(expand=True)
+        bloques = {}
 
         def obtener_semana(base):
-            lunes = base - timedelta(days=base.weekday())
+            lunes = datetime.combine(base.date() - timedelta(days=base.weekday()), datetime.min.time())
             return [lunes + timedelta(days=i) for i in range(5)]
 
+        def cargar_eventos():
+            # Solo se consulta la semana visible del veterinario seleccionado
+            nonlocal eventos
+            if veterinarios_activos:
+                eventos = CitaCRUD.buscar_semana(
+                    veterinario_seleccionado, obtener_semana(base_date)[0], busqueda
+                )
+                resolutor.adjuntar(eventos, CitaCRUD.referencias)
+            else:
+                eventos = []
+
+        def bloque_evento(ev, semana):
+            fechaInicio = ev["fechaInicio"]
+            if isinstance(fechaInicio, str):
+                fechaInicio = datetime.fromisoformat(fechaInicio)
+
+            dia_idx = (fechaInicio.date() - semana[0].date()).days
+            if not 0 <= dia_idx < len(semana):
+                return None
+
+            return ft.Container(
+                on_click=lambda e, _id=ev["_id"]: CitaCRUD.MostrarDetalladoView(_id, page),
+                top=(
+                    altura_encabezado
+                    + ((fechaInicio.hour - hora_inicio) * 60)
+                    + fechaInicio.minute
+                ),
+                left=60 + (dia_idx * 200),
+                content=ft.Text(
+                    f'{ev.get("duenio_nombre", ev["duenio"])} - {ev.get("mascota_nombre", ev["mascota"])}',
+                    size=12,
+                ),
+                bgcolor=ft.Colors.INVERSE_PRIMARY,
+                height=ev["duracion"] - 5,
+                width=190,
+                border_radius=ft.border_radius.all(6),
+                padding=ft.padding.all(5),
+                alignment=ft.alignment.top_left,
+            )
+
+        def aplicar_cambio(operacion, cita):
+            """Pone, mueve o quita el bloque de una sola cita después de crearla,
+            reprogramarla o eliminarla."""
+            nonlocal eventos
+            _id = str(cita["_id"])
+            anterior = bloques.pop(_id, None)
+            if anterior is not None:
+                stack_global.controls.remove(anterior)
+            eventos = [ev for ev in eventos if ev["_id"] != _id]
+
+            if (operacion != "eliminar" and cita.get("veterinario") == veterinario_seleccionado
+                    and coincide(cita, busqueda)):
+                ev = {campo: cita.get(campo) for campo in CitaCRUD.proyeccion_agenda}
+                ev.update(_id=_id, duenio=str(ev["duenio"]), mascota=str(ev["mascota"]))
+                resolutor.adjuntar([ev], CitaCRUD.referencias)
+                bloque = bloque_evento(ev, obtener_semana(base_date))
+                if bloque is not None:
+                    eventos.append(ev)
+                    bloques[_id] = bloque
+                    stack_global.controls.append(bloque)
+
+            if stack_global.page:
+                stack_global.update()
+            return True
+
+        contenedor_principal.data = aplicar_cambio
+
         def dibujar_tabla():
+            nonlocal stack_global
             contenedor_tabla.controls.clear()
             semana = obtener_semana(base_date)
 
-            # Filtrar eventos por veterinario seleccionado
-            eventos_filtrados = [
-                ev for ev in eventos if ev["veterinario"] == veterinario_seleccionado
-            ]
-
             # Encabezado
             fila_encabezado = ft.Row(
                 [
@@ -336,31 +477,8 @@ class CitaCRUD:
             )
             contenedor_tabla.controls.append(fila_encabezado)
 
-            # Precalcular posiciones de eventos
-            eventos_globales = []
-            for ev in eventos_filtrados:
-                for dia in semana:
-                    fechaInicio = ev["fechaInicio"]
-                    if isinstance(fechaInicio, str):
-                        fechaInicio = datetime.fromisoformat(fechaInicio)
-
-                    if fechaInicio.date() == dia.date():
-                        duracion = ev["duracion"]
-
-                        dia_idx = semana.index(dia)
-                        left = 60 + (dia_idx * 200)
-                        top = (
-                            altura_encabezado
-                            + ((fechaInicio.hour - hora_inicio) * 60)
-                            + fechaInicio.minute
-                        )
-                        height = duracion
-
-                        eventos_globales.append(
-                            {"top": top, "left": left, "height": height, "evento": ev}
-                        )
-
             stack_global = ft.Stack(expand=True)
+            bloques.clear()
 
             # Dibujar fondo de la tabla
             for h in range(hora_inicio, hora_fin):
@@ -392,21 +510,11 @@ class CitaCRUD:
                 contenedor_tabla.controls.append(fila)
 
             # Añadir eventos al stack global
-            for ev_data in eventos_globales:
-                ev = ev_data["evento"]
-                evento = ft.Container(
-                    on_click=lambda e, _id=ev["_id"]: CitaCRUD.MostrarDetalladoView(_id, page),
-                    top=ev_data["top"],
-                    left=ev_data["left"],
-                    content=ft.Text(f'{ev["duenio"]} - {ev["mascota"]}', size=12),
-                    bgcolor=ft.Colors.INVERSE_PRIMARY,
-                    height=ev_data["height"] - 5,
-                    width=190,
-                    border_radius=ft.border_radius.all(6),
-                    padding=ft.padding.all(5),
-                    alignment=ft.alignment.top_left,
-                )
-                stack_global.controls.append(evento)
+            for ev in eventos:
+                bloque = bloque_evento(ev, semana)
+                if bloque is not None:
+                    bloques[ev["_id"]] = bloque
+                    stack_global.controls.append(bloque)
 
             # Crear dropdown de veterinarios
             dropdown_veterinarios = ft.Dropdown(
@@ -454,23 +562,31 @@ class CitaCRUD:
         def cambiar_semana(delta):
             nonlocal base_date
             base_date += timedelta(days=delta)
+            cargar_eventos()
             dibujar_tabla()
 
         def cambiar_veterinario(vet):
             nonlocal veterinario_seleccionado
+            if vet == veterinario_seleccionado:
+                return
             veterinario_seleccionado = vet
+            cargar_eventos()
             dibujar_tabla()
 
         # Dibujar tabla inicial
+        if eventos is None:
+            cargar_eventos()
         dibujar_tabla()
 
         return contenedor_principal
 
     @staticmethod
-    def crearView(page):
+    def crearView(page, duenios=None, veterinarios=None):
 
-        duenios = DuenioCRUD.obtener_cedulas()
-        veterinarios = EmpleadoCRUD.obtener_veterinarios_activos()
+        if duenios is None:
+            duenios = DuenioCRUD.obtener_cedulas()
+        if veterinarios is None:
+            veterinarios = EmpleadoCRUD.obtener_veterinarios_activos()
 
         selected_duenio = ft.Ref[ft.Dropdown]()
         selected_mascota = ft.Ref[ft.Dropdown]()
@@ -564,36 +680,15 @@ class CitaCRUD:
                 # Validación de colisiones
                 inicio = cita.fechaInicio
                 fin = inicio + timedelta(minutes=cita.duracion)
-                conflictos = CitaCRUD.citas.find(
-                    {
-                        "veterinario": cita.veterinario,
-                        "$expr": {
-                            "$and": [
-                                {"$lt": ["$fechaInicio", fin]},
-                                {
-                                    "$gt": [
-                                        {
-                                            "$dateAdd": {
-                                                "startDate": "$fechaInicio",
-                                                "unit": "minute",
-                                                "amount": {"$toInt": "$duracion"},
-                                            }
-                                        },
-                                        inicio,
-                                    ]
-                                },
-                            ]
-                        },
-                    }
-                )
 
-                if list(conflictos):
+                if CitaCRUD.hay_conflicto(cita.veterinario, inicio, fin):
                     error.value = "Este veterinario ya tiene una cita en ese horario."
                     page.update()
                     return
 
-                CitaCRUD.crear(cita)
+                creada = CitaCRUD.crear(cita)
                 cerrar()
+                notificar_cambio(page, "citas", "crear", creada)
             except ValidationError as ve:
                 # Extrae los errores uno por uno (puede haber varios, aquí se toma el primero)
                 error.value = ve.errors()[0]["msg"]
@@ -657,3 +752,72 @@ class CitaCRUD:
         page.overlay.append(contenedor)
         page.update()
         #asyncio.create_task(recargar())
+
+    # Variantes async: las mismas operaciones sobre el cliente asíncrono,
+    # para que los handlers async de flet esperen los datos sin bloquear la sesión.
+
+    @staticmethod
+    async def crear_async(cita: CitaBase):
+        data = CitaCRUD.documento(cita)
+        insertado = await CitaCRUD.citas_async.insert_one(data)
+        return CitaCRUD.creada(data, insertado.inserted_id)
+
+    @staticmethod
+    async def hay_conflicto_async(veterinario: str, inicio: datetime, fin: datetime, excluir_id: str = None):
+        filtro = {
+            "veterinario": veterinario,
+            "fechaInicio": {"$lt": fin},
+            "fechaFin": {"$gt": inicio},
+        }
+        if excluir_id:
+            filtro["_id"] = {"$ne": ObjectId(excluir_id)}
+        return await CitaCRUD.citas_async.find_one(filtro, {"_id": 1}) is not None
+
+    @staticmethod
+    async def buscar_async(prompt: str = "", despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+        resultados, token = await buscar_documentos_async(CitaCRUD.citas_async, prompt, despues, limite, proyeccion)
+
+        for doc in resultados:
+            doc["_id"] = str(doc["_id"])
+            doc["duenio"] = str(doc.get("duenio", ""))
+            doc["mascota"] = str(doc.get("mascota", ""))
+        return resultados, token
+
+    @staticmethod
+    async def buscar_semana_async(veterinario: str, lunes: datetime, busqueda: str = ""):
+        filtro = {
+            "veterinario": veterinario,
+            "fechaInicio": {"$gte": lunes, "$lt": lunes + timedelta(days=5)},
+            **filtro_busqueda(busqueda),
+        }
+        resultados = await CitaCRUD.citas_async.find(filtro, CitaCRUD.proyeccion_agenda).to_list()
+        for doc in resultados:
+            doc["_id"] = str(doc["_id"])
+            doc["duenio"] = str(doc.get("duenio", ""))
+            doc["mascota"] = str(doc.get("mascota", ""))
+        return resultados
+
+    @staticmethod
+    async def mostrarView_async(busqueda, page=None):
+        # La semana depende del primer veterinario, así que estas dos consultas van en orden.
+        # Los cambios de semana o veterinario después se atienden con las consultas síncronas.
+        veterinarios = await EmpleadoCRUD.obtener_veterinarios_activos_async()
+        eventos = []
+        resolutor = ResolutorNombres()
+        if veterinarios:
+            hoy = datetime.now()
+            lunes = datetime.combine(hoy.date() - timedelta(days=hoy.weekday()), datetime.min.time())
+            eventos = await CitaCRUD.buscar_semana_async(veterinarios[0], lunes, busqueda)
+            await resolutor.adjuntar_async(eventos, CitaCRUD.referencias)
+        # Armar la grilla de la semana son cientos de controles; se hace en un hilo
+        # para que el loop siga atendiendo a las otras sesiones
+        return await asyncio.to_thread(CitaCRUD.mostrarView, busqueda, page, veterinarios, eventos, resolutor)
+
+    @staticmethod
+    async def crearView_async(page):
+        # Dueños y veterinarios no dependen entre sí: se piden al mismo tiempo
+        duenios, veterinarios = await asyncio.gather(
+            DuenioCRUD.obtener_cedulas_async(),
+            EmpleadoCRUD.obtener_veterinarios_activos_async(),
+        )
+        CitaCRUD.crearView(page, duenios, veterinarios)
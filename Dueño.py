@@ -2,35 +2,50 @@
 import asyncio
 import flet as ft
 from pydantic import ValidationError
-from MongoDB import db
+from MongoDB import db, db_async, SELLO, sellar
 from datetime import datetime, date
 from pymongo.collection import Collection
 from bson import ObjectId
 from schemas import MascotaBase, MascotaUpdate, FichaRapida, DuenioBase, DuenioUpdate
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
-from plantilla import crear_tabla_manual
+from plantilla import crear_tabla_manual, mostrar_dialogo_eliminar
+from Busqueda import (
+    CAMPO, TAM_PAGINA, buscar_documentos, buscar_documentos_async, claves_busqueda,
+    actualizar_claves, paginar, filtro_en_memoria,
+)
+import Ngramas
+from Ngramas import IndiceTrigramas
 
 from fastapi.encoders import jsonable_encoder
 from fastapi import HTTPException
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from Sesion import notificar_cambio
+from Cache import cacheado, invalidar
+from Instrumentacion import accion
 
 class MascotaCRUD:
 
     mascotas = db["registro_mascotas"]
     duenios = db["registro_duenios"]
+    mascotas_async = db_async["registro_mascotas"]
+    # Historia clínica: un documento por ficha, así la mascota no crece con cada consulta
+    fichas = db["registro_fichas"]
 
     @staticmethod
     def crear(mascota: MascotaBase, duenio_id: str):
         if not ObjectId.is_valid(duenio_id):
             raise HTTPException(status_code=400, detail="ID de dueño inválido")
 
-        if not MascotaCRUD.duenios.find_one({"_id": ObjectId(duenio_id)}):
+        duenio = MascotaCRUD.duenios.find_one({"_id": ObjectId(duenio_id)}, {"cedula": 1})
+        if not duenio:
             raise HTTPException(status_code=404, detail="Dueño no encontrado")
 
         mascota_data = jsonable_encoder(mascota)
         mascota_data["duenio_id"] = ObjectId(duenio_id)
-        insertado = MascotaCRUD.mascotas.insert_one(mascota_data)
+        insertado = MascotaCRUD.mascotas.insert_one(sellar(mascota_data))
 
         # Insertar también nombre y _id redundante
         MascotaCRUD.duenios.update_one(
@@ -40,10 +55,11 @@ class MascotaCRUD:
                     "_id": insertado.inserted_id,
                     "nombre": mascota.nombre
                 }
-            }}
+            }, **SELLO}
         )
+        invalidar("datos:mascotas", f"mascotas:{duenio.get('cedula')}")
 
-        return str(insertado.inserted_id)
+        return {**mascota_data, "_id": str(insertado.inserted_id)}
 
     @staticmethod
     def actualizar(id: str, update: MascotaUpdate):
@@ -54,35 +70,66 @@ class MascotaCRUD:
         if not data:
             raise HTTPException(status_code=400, detail="No se proporcionaron campos para actualizar")
 
-        result = MascotaCRUD.mascotas.update_one({"_id": ObjectId(id)}, {"$set": data})
-        if result.matched_count == 0:
+        mascota = MascotaCRUD.mascotas.find_one_and_update(
+            {"_id": ObjectId(id)}, {"$set": data, **SELLO}, return_document=ReturnDocument.AFTER
+        )
+        if mascota is None:
             raise HTTPException(status_code=404, detail="Mascota no encontrada")
 
         # Si cambió el nombre, actualizamos el nombre redundante dentro del dueño
-        if "nombre" in data:
-            mascota = MascotaCRUD.mascotas.find_one({"_id": ObjectId(id)})
-            if mascota and "duenio_id" in mascota:
-                MascotaCRUD.duenios.update_one(
-                    {"_id": mascota["duenio_id"], "mascotas._id": ObjectId(id)},
-                    {"$set": {"mascotas.$.nombre": data["nombre"]}}
-                )
+        if "nombre" in data and "duenio_id" in mascota:
+            duenio = MascotaCRUD.duenios.find_one_and_update(
+                {"_id": mascota["duenio_id"], "mascotas._id": ObjectId(id)},
+                {"$set": {"mascotas.$.nombre": data["nombre"]}, **SELLO},
+                projection={"cedula": 1},
+            )
+            if duenio:
+                invalidar(f"mascotas:{duenio.get('cedula')}")
+        invalidar("datos:mascotas")
+
+        mascota["_id"] = id
+        return mascota
 
-        return True
+    @staticmethod
+    def documento_ficha(mascota_id: ObjectId, ficha: dict):
+        # La fecha se guarda como datetime para ordenar y paginar por ella
+        fecha = ficha.get("fecha")
+        if isinstance(fecha, str):
+            fecha = datetime.fromisoformat(fecha)
+        elif isinstance(fecha, date) and not isinstance(fecha, datetime):
+            fecha = datetime.combine(fecha, datetime.min.time())
+        return {**ficha, "mascota_id": mascota_id, "fecha": fecha}
 
     @staticmethod
     def agregar_ficha(mascota_id: str, ficha: FichaRapida):
         if not ObjectId.is_valid(mascota_id):
             raise HTTPException(status_code=400, detail="ID de mascota inválido")
 
-        result = MascotaCRUD.mascotas.update_one(
-            {"_id": ObjectId(mascota_id)},
-            {"$push": {"fichas": jsonable_encoder(ficha)}}
-        )
-
-        if result.matched_count == 0:
+        if not MascotaCRUD.mascotas.find_one({"_id": ObjectId(mascota_id)}, {"_id": 1}):
             raise HTTPException(status_code=404, detail="Mascota no encontrada")
 
-        return True
+        insertado = MascotaCRUD.fichas.insert_one(
+            MascotaCRUD.documento_ficha(ObjectId(mascota_id), ficha.model_dump())
+        )
+        return str(insertado.inserted_id)
+
+    @staticmethod
+    def listar_fichas(mascota_id: str, despues: str = None, limite: int = TAM_PAGINA):
+        """Devuelve (pagina, token) con las fichas de la mascota, más recientes primero.
+        El token es "fecha|_id" de la última ficha de la página."""
+        filtro = {"mascota_id": ObjectId(mascota_id)}
+        if despues:
+            fecha, ultimo = despues.split("|", 1)
+            fecha, ultimo = datetime.fromisoformat(fecha), ObjectId(ultimo)
+            filtro["$or"] = [{"fecha": {"$lt": fecha}}, {"fecha": fecha, "_id": {"$lt": ultimo}}]
+
+        cursor = MascotaCRUD.fichas.find(filtro, {"mascota_id": 0}).sort([("fecha", -1), ("_id", -1)])
+        docs = list(cursor.limit(limite + 1 if limite else 0))
+        pagina, token = paginar(docs, limite, lambda d: f"{d['fecha'].isoformat()}|{d['_id']}")
+        for ficha in pagina:
+            ficha["_id"] = str(ficha["_id"])
+            ficha["fecha"] = ficha["fecha"].date().isoformat()
+        return pagina, token
 
     @staticmethod
     def eliminar(id: str):
@@ -92,26 +139,27 @@ class MascotaCRUD:
         mascota = MascotaCRUD.mascotas.find_one_and_delete({"_id": ObjectId(id)})
         if not mascota:
             raise HTTPException(status_code=404, detail="Mascota no encontrada")
+        MascotaCRUD.fichas.delete_many({"mascota_id": ObjectId(id)})
 
         duenio_id = mascota.get("duenio_id")
         if duenio_id:
-            MascotaCRUD.duenios.update_one(
+            duenio = MascotaCRUD.duenios.find_one_and_update(
                 {"_id": duenio_id},
-                {"$pull": {"mascotas": {"_id": ObjectId(id)}}}
+                {"$pull": {"mascotas": {"_id": ObjectId(id)}}, **SELLO},
+                projection={"cedula": 1},
             )
+            if duenio:
+                invalidar(f"mascotas:{duenio.get('cedula')}")
+        invalidar("datos:mascotas")
 
-        return True
+        mascota["_id"] = id
+        return mascota
     
 
     @staticmethod
+    @accion("ver fichas de mascota")
     def mostrarFichas(page, mascota_id: str):
-        mascota = MascotaCRUD.mascotas.find_one({"_id": ObjectId(mascota_id)})
-        if not mascota:
-            return
-
-        fichas = mascota.get("fichas", [])
-        for ficha in fichas:
-            ficha["fecha"] = str(ficha.get("fecha", ""))
+        fichas, token = MascotaCRUD.listar_fichas(mascota_id)
 
         def cerrar(e=None):
             bs.open = False
@@ -121,7 +169,12 @@ class MascotaCRUD:
             ft.Container(
                 ft.Column([
                     ft.Text("Fichas Médicas", size=20, weight=ft.FontWeight.BOLD),
-                    crear_tabla_manual(fichas, lambda e, i: print("Ficha seleccionada"))
+                    crear_tabla_manual(
+                        fichas,
+                        lambda e, i: print("Ficha seleccionada"),
+                        token=token,
+                        cargar_mas=lambda t: MascotaCRUD.listar_fichas(mascota_id, t),
+                    )
                 ]),
                 padding=20
             ),
@@ -159,16 +212,16 @@ class MascotaCRUD:
                     veterinario_encargado=veterinario_encargado
                 )
 
-                MascotaCRUD.mascotas.update_one(
-                    {"_id": ObjectId(mascota_id)},
-                    {"$push": {"fichas": jsonable_encoder(ficha)}}
-                )
+                MascotaCRUD.agregar_ficha(mascota_id, ficha)
                 cerrar_bs()
 
             except ValidationError as ve:
                 # Extrae los errores uno por uno (puede haber varios, aquí se toma el primero)
                 error.value = ve.errors()[0]["msg"]
 
+            except HTTPException as he:
+                error.value = he.detail
+
             except Exception as ex:
                 error.value = str(ex)
             page.update()
@@ -195,6 +248,7 @@ class MascotaCRUD:
 
 
     @staticmethod
+    @accion("abrir detalle de mascota")
     def mostrarDetallesView(page, mascota_id: str):
         mascota = MascotaCRUD.mascotas.find_one({"_id": ObjectId(mascota_id)})
         if not mascota:
@@ -241,7 +295,7 @@ class MascotaCRUD:
         if not ObjectId.is_valid(duenio_id):
             raise HTTPException(status_code=400, detail="ID de dueño inválido")
 
-        duenio = MascotaCRUD.duenios.find_one({"_id": ObjectId(duenio_id)})
+        duenio = MascotaCRUD.duenios.find_one({"_id": ObjectId(duenio_id)}, {"mascotas": 1})
         if not duenio:
             raise HTTPException(status_code=404, detail="Dueño no encontrado")
 
@@ -252,7 +306,9 @@ class MascotaCRUD:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error al convertir ids de mascota: {e}")
 
-        mascotas = list(MascotaCRUD.mascotas.find({"_id": {"$in": objetos_ids}}))
+        mascotas = list(MascotaCRUD.mascotas.find(
+            {"_id": {"$in": objetos_ids}}, {"nombre": 1, "raza": 1, "fecha_nacimiento": 1}
+        ))
 
         lista = []
         for m in mascotas:
@@ -315,7 +371,6 @@ class MascotaCRUD:
                     "sexo": campos["sexo"].value,
                     "peso": float(campos["peso"].value),
                     "fecha_nacimiento": datetime.strptime(campos["fecha_nacimiento"].value, "%Y-%m-%d").date(),
-                    "fichas": []
                 }
                 
                 mascota = MascotaBase(**data)
@@ -355,12 +410,23 @@ class MascotaCRUD:
         page.update()
 
     @staticmethod
+    @cacheado(lambda cedula: f"mascotas:{cedula}", nombre="nombres_por_duenio")
     def obtener_nombres_por_duenio(cedula: str):
-        duenio = DuenioCRUD.duenios.find_one({"cedula": cedula})
+        duenio = DuenioCRUD.duenios.find_one({"cedula": cedula}, {"mascotas": 1})
+        if not duenio:
+            return []
+        ids = [ObjectId(m["_id"] if isinstance(m, dict) else m) for m in duenio.get("mascotas", [])]
+        mascotas = MascotaCRUD.mascotas.find({"_id": {"$in": ids}}, {"nombre": 1})
+        return [m.get("nombre", "Sin nombre") for m in mascotas]
+
+    @staticmethod
+    @cacheado(lambda cedula: f"mascotas:{cedula}", nombre="nombres_por_duenio")
+    async def obtener_nombres_por_duenio_async(cedula: str):
+        duenio = await DuenioCRUD.duenios_async.find_one({"cedula": cedula}, {"mascotas": 1})
         if not duenio:
             return []
-        ids = duenio.get("mascotas", [])
-        mascotas = MascotaCRUD.mascotas.find({"_id": {"$in": [ObjectId(m["_id"] if isinstance(m, dict) else m) for m in ids]}})
+        ids = [ObjectId(m["_id"] if isinstance(m, dict) else m) for m in duenio.get("mascotas", [])]
+        mascotas = await MascotaCRUD.mascotas_async.find({"_id": {"$in": ids}}, {"nombre": 1}).to_list()
         return [m.get("nombre", "Sin nombre") for m in mascotas]
 
 
@@ -368,12 +434,24 @@ class MascotaCRUD:
 class DuenioCRUD:
     # Variable de clase (compartida por todos los métodos)
     duenios = db["registro_duenios"]
+    duenios_async = db_async["registro_duenios"]
+    campos_busqueda = ["cedula", "nombre", "gmail", "telefono", "direccion"]
+    # Campos que muestra la tabla; el resto no viaja desde la base
+    campos_tabla = ["cedula", "nombre", "gmail", "telefono", "direccion"]
+    proyeccion_tabla = {c: 1 for c in campos_tabla}
+    indice = IndiceTrigramas(duenios, campos_tabla, campos_busqueda)
 
     @staticmethod
     def crear(duenio: DuenioBase):
         data = jsonable_encoder(duenio)
-        insertado = DuenioCRUD.duenios.insert_one(data)
-        return str(insertado.inserted_id)
+        data[CAMPO] = claves_busqueda(data, DuenioCRUD.campos_busqueda)
+        try:
+            insertado = DuenioCRUD.duenios.insert_one(sellar(data))
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail="Ya existe un dueño con esa cédula")
+        DuenioCRUD.indice.agregar({**data, "_id": insertado.inserted_id})
+        invalidar("cedulas", "datos:duenios")
+        return {**data, "_id": str(insertado.inserted_id)}
 
     @staticmethod
     def actualizar(id: str, update: DuenioUpdate):
@@ -384,52 +462,51 @@ class DuenioCRUD:
         if not data:
             raise HTTPException(status_code=400, detail="No se proporcionaron campos para actualizar")
 
-        result = DuenioCRUD.duenios.update_one({ "_id": ObjectId(id) }, { "$set": data })
+        duenio = actualizar_claves(DuenioCRUD.duenios, ObjectId(id), data, DuenioCRUD.campos_busqueda, SELLO)
 
-        if result.matched_count == 0:
+        if duenio is None:
             raise HTTPException(status_code=404, detail="Dueño no encontrado")
 
-        return True
+        if set(data) & set(DuenioCRUD.campos_busqueda):
+            DuenioCRUD.indice.agregar(duenio)
+        invalidar("datos:duenios")
+
+        duenio["_id"] = id
+        return duenio
 
     @staticmethod
     def eliminar(id: str):
         if not ObjectId.is_valid(id):
             raise HTTPException(status_code=400, detail="ID inválido")
 
-        resultado = DuenioCRUD.duenios.delete_one({ "_id": ObjectId(id) })
-        if resultado.deleted_count == 0:
+        duenio = DuenioCRUD.duenios.find_one_and_delete({ "_id": ObjectId(id) }, projection={CAMPO: 0})
+        if not duenio:
             raise HTTPException(status_code=404, detail="Dueño no encontrado")
+        DuenioCRUD.indice.quitar(id)
+        invalidar("cedulas", "datos:duenios", f"mascotas:{duenio.get('cedula')}")
 
-        return True
+        duenio["_id"] = id
+        return duenio
 
     @staticmethod
-    def buscar(prompt: str = ""):
-        if not prompt.strip():
-            resultados = list(DuenioCRUD.duenios.find())
-        else:
-            primer_doc = DuenioCRUD.duenios.find_one()
-            if not primer_doc:
-                return []
-
-            regex = {"$regex": prompt, "$options": "i"}
-            condiciones = []
-            for campo in primer_doc:
-                if campo == "_id":
-                    continue
-                condiciones.append({ campo: regex })
-
-            resultados = list(DuenioCRUD.duenios.find({ "$or": condiciones }))
+    def buscar(prompt: str = "", despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+        resultados, token = buscar_documentos(DuenioCRUD.duenios, prompt, despues, limite, proyeccion)
 
         for doc in resultados:
             doc["_id"] = str(doc["_id"])
             if "mascotas" in doc:
                 doc["mascotas"] = [str(m) for m in doc["mascotas"]]
     
-        return resultados
+        return resultados, token
 
     @staticmethod
+    def buscar_tabla(prompt: str = "", despues: str = None):
+        return DuenioCRUD.buscar(prompt, despues, proyeccion=DuenioCRUD.proyeccion_tabla)
+
+    @staticmethod
+    @accion("abrir detalle de dueño")
     def mostrarDetalleView(page, duenio_id: str):
-        duenio = DuenioCRUD.duenios.find_one({"_id": ObjectId(duenio_id)})
+        duenio = DuenioCRUD.duenios.find_one({"_id": ObjectId(duenio_id)}, {"nombre": 1, "mascotas": 1})
         if not duenio:
             return
 
@@ -448,7 +525,16 @@ class DuenioCRUD:
         def cerrar_bs(e=None):
             bs.open = False
             page.update()
-        ft.Text()
+
+        def eliminar():
+            try:
+                eliminado = DuenioCRUD.eliminar(duenio_id)
+            except HTTPException:
+                # Ya lo había borrado otra persona: igual se saca de la tabla
+                eliminado = {"_id": duenio_id}
+            cerrar_bs()
+            notificar_cambio(page, "duenios", "eliminar", eliminado)
+
         bs = ft.BottomSheet(
             ft.Container(
                 ft.Column(
@@ -501,7 +587,7 @@ class DuenioCRUD:
                                         bgcolor=ft.Colors.ERROR_CONTAINER,
                                         color=ft.Colors.ON_ERROR_CONTAINER
                                     ),
-                                    on_click=lambda e: print("Eliminar dueño")
+                                    on_click=lambda e: mostrar_dialogo_eliminar(page, eliminar)
                                 ),
                             ],
                             alignment=ft.MainAxisAlignment.END
@@ -520,12 +606,16 @@ class DuenioCRUD:
 
     @staticmethod
     def mostrarView(busqueda: str = ""):
-        datos = DuenioCRUD.buscar(busqueda)
+        fuente = DuenioCRUD.indice.buscar if Ngramas.ACTIVO else DuenioCRUD.buscar_tabla
+        datos, token = fuente(busqueda)
         print(f"Datos:  {datos}")
         return crear_tabla_manual(
             datos,
             lambda e, i: DuenioCRUD.mostrarDetalleView(e.control.page, i),
-            ["mascotas"]
+            ["mascotas"],
+            token=token,
+            cargar_mas=lambda t: fuente(busqueda, t),
+            filtro=filtro_en_memoria(busqueda),
         )
     
     @staticmethod
@@ -553,16 +643,14 @@ class DuenioCRUD:
             try:
                 data = {k: v.value for k, v in campos.items()}
                 duenio = DuenioBase(**data)
-
-                if DuenioCRUD.duenios.find_one({ "cedula": duenio.cedula }):
-                    error.value = "Ya existe un dueño con esa cédula."
-                else:
-                    data = jsonable_encoder(duenio)
-                    DuenioCRUD.duenios.insert_one(data)
-                    cerrar_bs()
+                creado = DuenioCRUD.crear(duenio)
+                cerrar_bs()
+                notificar_cambio(page, "duenios", "crear", creado)
 
             except ValidationError as ve:
                 error.value = ve.errors()[0]["msg"]
+            except HTTPException as ex:
+                error.value = ex.detail
             
             page.update()
             #recargar(e)
@@ -602,7 +690,46 @@ class DuenioCRUD:
 
 
     @staticmethod
+    @cacheado("cedulas", nombre="cedulas")
     def obtener_cedulas():
-        return [d.get("cedula", "Sin nombre") for d in DuenioCRUD.duenios.find()]
+        return [d.get("cedula", "Sin nombre") for d in DuenioCRUD.duenios.find({}, {"cedula": 1})]
+
+    # Variantes async: las mismas operaciones sobre el cliente asíncrono,
+    # para que los handlers async de flet esperen los datos sin bloquear la sesión.
+
+    @staticmethod
+    async def buscar_async(prompt: str = "", despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+        resultados, token = await buscar_documentos_async(DuenioCRUD.duenios_async, prompt, despues, limite, proyeccion)
+
+        for doc in resultados:
+            doc["_id"] = str(doc["_id"])
+            if "mascotas" in doc:
+                doc["mascotas"] = [str(m) for m in doc["mascotas"]]
+
+        return resultados, token
+
+    @staticmethod
+    async def mostrarView_async(busqueda: str = ""):
+        if Ngramas.ACTIVO:
+            # La primera búsqueda carga el índice desde Mongo: se hace fuera del loop
+            datos, token = await asyncio.to_thread(DuenioCRUD.indice.buscar, busqueda)
+        else:
+            datos, token = await DuenioCRUD.buscar_async(busqueda, proyeccion=DuenioCRUD.proyeccion_tabla)
+        # Las páginas siguientes se piden desde el handler de scroll, que flet corre en un hilo
+        fuente = DuenioCRUD.indice.buscar if Ngramas.ACTIVO else DuenioCRUD.buscar_tabla
+        return crear_tabla_manual(
+            datos,
+            lambda e, i: DuenioCRUD.mostrarDetalleView(e.control.page, i),
+            ["mascotas"],
+            token=token,
+            cargar_mas=lambda t: fuente(busqueda, t),
+            filtro=filtro_en_memoria(busqueda),
+        )
+
+    @staticmethod
+    @cacheado("cedulas", nombre="cedulas")
+    async def obtener_cedulas_async():
+        duenios = await DuenioCRUD.duenios_async.find({}, {"cedula": 1}).to_list()
+        return [d.get("cedula", "Sin nombre") for d in duenios]
 
 
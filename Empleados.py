@@ -3,19 +3,39 @@ import flet as ft
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException
 from bson import ObjectId
-from MongoDB import db
+from MongoDB import db, db_async, SELLO, sellar
 from schemas import EmpleadoBase, EmpleadoUpdate
 from pydantic import ValidationError
-from plantilla import crear_tabla_manual
+from plantilla import crear_tabla_manual, mostrar_dialogo_eliminar
+from Sesion import notificar_cambio
+from Cache import cacheado, invalidar
+from Instrumentacion import accion
+from Busqueda import (
+    CAMPO, TAM_PAGINA, buscar_documentos, buscar_documentos_async, claves_busqueda,
+    actualizar_claves, filtro_en_memoria,
+)
+import Ngramas
+from Ngramas import IndiceTrigramas
 
 class EmpleadoCRUD:
     empleados = db["registro_empleados"]
+    empleados_async = db_async["registro_empleados"]
+    campos_busqueda = ["rol", "nombre", "especialidad", "estado"]
+    # Campos que cambian la lista de veterinarios activos
+    campos_veterinarios = {"rol", "nombre", "estado"}
+    # Campos que muestra la tabla; el resto no viaja desde la base
+    campos_tabla = ["rol", "nombre", "especialidad", "estado"]
+    proyeccion_tabla = {c: 1 for c in campos_tabla}
+    indice = IndiceTrigramas(empleados, campos_tabla, campos_busqueda)
 
     @staticmethod
     def crear(empleado: EmpleadoBase):
         data = empleado.model_dump()
-        insertado = EmpleadoCRUD.empleados.insert_one(data)
-        return str(insertado.inserted_id)
+        data[CAMPO] = claves_busqueda(data, EmpleadoCRUD.campos_busqueda)
+        insertado = EmpleadoCRUD.empleados.insert_one(sellar(data))
+        EmpleadoCRUD.indice.agregar({**data, "_id": insertado.inserted_id})
+        invalidar("veterinarios", "datos:empleados")
+        return {**data, "_id": str(insertado.inserted_id)}
 
     @staticmethod
     def actualizar(id: str, update: EmpleadoUpdate):
@@ -26,57 +46,63 @@ class EmpleadoCRUD:
         if not data:
             raise HTTPException(status_code=400, detail="No se proporcionaron campos para actualizar")
 
-        result = EmpleadoCRUD.empleados.update_one({"_id": ObjectId(id)}, {"$set": data})
+        empleado = actualizar_claves(EmpleadoCRUD.empleados, ObjectId(id), data, EmpleadoCRUD.campos_busqueda, SELLO)
 
-        if result.matched_count == 0:
+        if empleado is None:
             raise HTTPException(status_code=404, detail="Empleado no encontrado")
 
-        return True
+        if set(data) & EmpleadoCRUD.campos_veterinarios:
+            invalidar("veterinarios")
+
+        if set(data) & set(EmpleadoCRUD.campos_busqueda):
+            EmpleadoCRUD.indice.agregar(empleado)
+        invalidar("datos:empleados")
+
+        empleado["_id"] = str(empleado["_id"])
+        return empleado
 
     @staticmethod
     def eliminar(id: str):
         if not ObjectId.is_valid(id):
             raise HTTPException(status_code=400, detail="ID inválido")
 
-        resultado = EmpleadoCRUD.empleados.delete_one({"_id": ObjectId(id)})
-        if resultado.deleted_count == 0:
+        empleado = EmpleadoCRUD.empleados.find_one_and_delete({"_id": ObjectId(id)}, projection={CAMPO: 0})
+        if empleado is None:
             raise HTTPException(status_code=404, detail="Empleado no encontrado")
+        EmpleadoCRUD.indice.quitar(id)
+        invalidar("veterinarios", "datos:empleados")
 
-        return True
+        empleado["_id"] = id
+        return empleado
 
     @staticmethod
-    def buscar(prompt: str = ""):
-        if not prompt.strip():
-            resultados = list(EmpleadoCRUD.empleados.find())
-        else:
-            primer_doc = EmpleadoCRUD.empleados.find_one()
-            if not primer_doc:
-                return []
-
-            regex = {"$regex": prompt, "$options": "i"}
-            condiciones = []
-            for campo in primer_doc:
-                if campo == "_id":
-                    continue
-                condiciones.append({campo: regex})
-
-            resultados = list(EmpleadoCRUD.empleados.find({"$or": condiciones}))
+    def buscar(prompt: str = "", despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+        resultados, token = buscar_documentos(EmpleadoCRUD.empleados, prompt, despues, limite, proyeccion)
 
         for doc in resultados:
             doc["_id"] = str(doc["_id"])
-        return resultados
+        return resultados, token
+
+    @staticmethod
+    def buscar_tabla(prompt: str = "", despues: str = None):
+        return EmpleadoCRUD.buscar(prompt, despues, proyeccion=EmpleadoCRUD.proyeccion_tabla)
 
     @staticmethod
     def mostrarView(busqueda: str = ""):
-        datos = EmpleadoCRUD.buscar(busqueda)
+        fuente = EmpleadoCRUD.indice.buscar if Ngramas.ACTIVO else EmpleadoCRUD.buscar_tabla
+        datos, token = fuente(busqueda)
         return crear_tabla_manual(
             datos,
-            lambda e, i: EmpleadoCRUD.mostrarDetalleView(e.control.page, i)
+            lambda e, i: EmpleadoCRUD.mostrarDetalleView(e.control.page, i),
+            token=token,
+            cargar_mas=lambda t: fuente(busqueda, t),
+            filtro=filtro_en_memoria(busqueda),
         )
 
     @staticmethod
+    @accion("abrir detalle de empleado")
     def mostrarDetalleView(page, empleado_id: str):
-        empleado = EmpleadoCRUD.empleados.find_one({"_id": ObjectId(empleado_id)})
+        empleado = EmpleadoCRUD.empleados.find_one({"_id": ObjectId(empleado_id)}, EmpleadoCRUD.proyeccion_tabla)
         if not empleado:
             return
 
@@ -91,6 +117,15 @@ class EmpleadoCRUD:
             bs.open = False
             page.update()
 
+        def eliminar():
+            try:
+                eliminado = EmpleadoCRUD.eliminar(empleado_id)
+            except HTTPException:
+                # Ya lo había borrado otra persona: igual se saca de la tabla
+                eliminado = {"_id": empleado_id}
+            cerrar()
+            notificar_cambio(page, "empleados", "eliminar", eliminado)
+
         bs = ft.BottomSheet(
             ft.Container(
                 ft.Column([
@@ -103,7 +138,10 @@ class EmpleadoCRUD:
                     ], scroll=ft.ScrollMode.AUTO, height=200),
                     ft.Row([
                         ft.ElevatedButton("Actualizar", icon=ft.Icons.EDIT),
-                        ft.ElevatedButton("Eliminar", icon=ft.Icons.DELETE, icon_color=ft.Colors.ERROR),
+                        ft.ElevatedButton(
+                            "Eliminar", icon=ft.Icons.DELETE, icon_color=ft.Colors.ERROR,
+                            on_click=lambda e: mostrar_dialogo_eliminar(page, eliminar),
+                        ),
                     ], alignment=ft.MainAxisAlignment.END)
                 ]),
                 padding=20
@@ -156,8 +194,9 @@ class EmpleadoCRUD:
             try:
                 data = {k: v.value for k, v in campos.items()}
                 empleado = EmpleadoBase(**data)
-                EmpleadoCRUD.crear(empleado)
+                creado = EmpleadoCRUD.crear(empleado)
                 cerrar_bs()
+                notificar_cambio(page, "empleados", "crear", creado)
             except ValidationError as ve:
                 error.value = ve.errors()[0]["msg"]
             page.update()
@@ -184,11 +223,49 @@ class EmpleadoCRUD:
         #asyncio.create_task(recargar())
 
     @staticmethod
+    @cacheado("veterinarios", nombre="veterinarios_activos")
     def obtener_veterinarios_activos():
         empleados = EmpleadoCRUD.empleados.find({
             "rol": {"$regex": "veterinario", "$options": "i"},
             "estado": "activo"
-        })
+        }, {"nombre": 1})
+
+        return [empleado["nombre"] for empleado in empleados]
+
+    @staticmethod
+    @cacheado("veterinarios", nombre="veterinarios_activos")
+    async def obtener_veterinarios_activos_async():
+        empleados = await EmpleadoCRUD.empleados_async.find({
+            "rol": {"$regex": "veterinario", "$options": "i"},
+            "estado": "activo"
+        }, {"nombre": 1}).to_list()
 
         return [empleado["nombre"] for empleado in empleados]
 
+    # Variantes async: las mismas operaciones sobre el cliente asíncrono,
+    # para que los handlers async de flet esperen los datos sin bloquear la sesión.
+
+    @staticmethod
+    async def buscar_async(prompt: str = "", despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+        resultados, token = await buscar_documentos_async(EmpleadoCRUD.empleados_async, prompt, despues, limite, proyeccion)
+
+        for doc in resultados:
+            doc["_id"] = str(doc["_id"])
+        return resultados, token
+
+    @staticmethod
+    async def mostrarView_async(busqueda: str = ""):
+        if Ngramas.ACTIVO:
+            # La primera búsqueda carga el índice desde Mongo: se hace fuera del loop
+            datos, token = await asyncio.to_thread(EmpleadoCRUD.indice.buscar, busqueda)
+        else:
+            datos, token = await EmpleadoCRUD.buscar_async(busqueda, proyeccion=EmpleadoCRUD.proyeccion_tabla)
+        # Las páginas siguientes se piden desde el handler de scroll, que flet corre en un hilo
+        fuente = EmpleadoCRUD.indice.buscar if Ngramas.ACTIVO else EmpleadoCRUD.buscar_tabla
+        return crear_tabla_manual(
+            datos,
+            lambda e, i: EmpleadoCRUD.mostrarDetalleView(e.control.page, i),
+            token=token,
+            cargar_mas=lambda t: fuente(busqueda, t),
+            filtro=filtro_en_memoria(busqueda),
+        )
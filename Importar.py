@@ -0,0 +1,197 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from schemas import DuenioBase, MascotaBase, CitaBase, validar_lote
+from Busqueda import CAMPO, claves_busqueda
+from Dueño import DuenioCRUD, MascotaCRUD
+from Citas import CitaCRUD
+from Cache import invalidar
+from MongoDB import SELLO, sellar
+
+LOTE = 1000
+# Lo que queda viejo en la aplicación después de importar cada tipo
+INVALIDA = {
+    "duenios": ("datos:duenios", "cedulas"),
+    "mascotas": ("datos:mascotas",),
+    "citas": ("datos:citas",),
+}
+
+
+def leer_filas(ruta: str, formato: str = None):
+    """Genera (numero, fila) sin cargar el archivo completo. En CSV las celdas vacías se omiten."""
+    formato = formato or os.path.splitext(ruta)[1].lstrip(".").lower()
+    with open(ruta, encoding="utf-8-sig", newline="") as archivo:
+        if formato == "csv":
+            # La fila 1 es el encabezado
+            for numero, fila in enumerate(csv.DictReader(archivo), start=2):
+                yield numero, {k: v for k, v in fila.items() if k and v not in ("", None)}
+        elif formato in ("jsonl", "ndjson"):
+            for numero, linea in enumerate(archivo, start=1):
+                if linea.strip():
+                    try:
+                        yield numero, json.loads(linea)
+                    except json.JSONDecodeError as e:
+                        yield numero, e
+        else:
+            raise ValueError(f"Formato no soportado: {formato} (use csv o jsonl)")
+
+
+def lotes(filas, tamanio: int):
+    filas = iter(filas)
+    while lote := list(islice(filas, tamanio)):
+        yield lote
+
+
+def describir(error):
+    # Recibe una excepción o la lista de errores de pydantic de una fila
+    if isinstance(error, ValidationError):
+        error = error.errors()
+    if isinstance(error, list):
+        return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'fila'}: {e['msg']}" for e in error)
+    return str(error)
+
+
+class Importador:
+    """Valida e inserta un lote por vez. Los errores se informan por fila y no detienen la carga."""
+
+    def __init__(self, tipo: str, errores=sys.stderr):
+
+        self.tipo = tipo
+        self.errores = errores
+        self.insertadas = 0
+        self.fallidas = 0
+
+    def error(self, numero: int, mensaje: str):
+        self.fallidas += 1
+        print(f"fila {numero}: {mensaje}", file=self.errores)
+
+    def validar(self, lote: list, modelo):
+        # Todo el lote se valida en una sola llamada a pydantic
+        filas = []
+        for numero, fila in lote:
+            if isinstance(fila, Exception):
+                self.error(numero, describir(fila))
+            else:
+                filas.append((numero, fila))
+
+        validos, errores = validar_lote(modelo, [fila for _, fila in filas])
+        for indice, detalle in errores:
+            self.error(filas[indice][0], describir(detalle))
+        return [(filas[i][0], filas[i][1], instancia) for i, instancia in validos]
+
+    def insertar(self, coleccion, numeros: list[int], docs: list[dict]):
+        """insert_many sin orden: un duplicado no frena al resto. Devuelve los documentos insertados."""
+        if not docs:
+            return []
+        fallidos = set()
+        try:
+            coleccion.insert_many([sellar(doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            for detalle in e.details.get("writeErrors", []):
+                fallidos.add(detalle["index"])
+                self.error(numeros[detalle["index"]], detalle.get("errmsg", "error de escritura"))
+        insertados = [doc for i, doc in enumerate(docs) if i not in fallidos]
+        self.insertadas += len(insertados)
+        return insertados
+
+    def duenios(self, lote: list):
+        numeros, docs = [], []
+        for numero, _, duenio in self.validar(lote, DuenioBase):
+            data = jsonable_encoder(duenio)
+            data[CAMPO] = claves_busqueda(data, DuenioCRUD.campos_busqueda)
+            numeros.append(numero)
+            docs.append(data)
+        self.insertar(DuenioCRUD.duenios, numeros, docs)
+
+    def ids_duenios(self, referencias: set):
+        """Una sola consulta por lote: la referencia puede ser la cédula o el _id del dueño.
+        Devuelve referencia -> _id y _id -> cédula."""
+        ids = [ObjectId(r) for r in referencias if ObjectId.is_valid(r)]
+        filtro = {"$or": [{"cedula": {"$in": list(referencias)}}, {"_id": {"$in": ids}}]}
+        encontrados, cedulas = {}, {}
+        for doc in DuenioCRUD.duenios.find(filtro, {"cedula": 1}):
+            encontrados[doc.get("cedula")] = doc["_id"]
+            encontrados[str(doc["_id"])] = doc["_id"]
+            cedulas[doc["_id"]] = doc.get("cedula")
+        return encontrados, cedulas
+
+    def mascotas(self, lote: list):
+        validos = self.validar(lote, MascotaBase)
+        duenios, cedulas = self.ids_duenios({str(f.get("duenio", "")) for _, f, _ in validos})
+
+        numeros, docs = [], []
+        for numero, fila, mascota in validos:
+            duenio_id = duenios.get(str(fila.get("duenio", "")))
+            if duenio_id is None:
+                self.error(numero, f"dueño no encontrado: {fila.get('duenio')}")
+                continue
+            data = jsonable_encoder(mascota)
+            data["_id"] = ObjectId()
+            data["duenio_id"] = duenio_id
+            numeros.append(numero)
+            docs.append(data)
+
+        # Se enlazan con un $push por dueño en vez de uno por mascota
+        por_duenio = defaultdict(list)
+        for doc in self.insertar(MascotaCRUD.mascotas, numeros, docs):
+            por_duenio[doc["duenio_id"]].append({"_id": doc["_id"], "nombre": doc["nombre"]})
+        if por_duenio:
+            DuenioCRUD.duenios.bulk_write([
+                UpdateOne({"_id": duenio_id}, {"$push": {"mascotas": {"$each": mascotas}}, **SELLO})
+                for duenio_id, mascotas in por_duenio.items()
+            ], ordered=False)
+            # La lista de mascotas de cada dueño se guarda en caché por cédula (nombres_por_duenio);
+            # se avisa por lote para no juntar las cédulas de toda la importación
+            invalidar(*(f"mascotas:{cedulas.get(d)}" for d in por_duenio))
+
+    def citas(self, lote: list):
+        numeros, docs = [], []
+        for numero, _, cita in self.validar(lote, CitaBase):
+            data = cita.model_dump()
+            data["duracion"] = int(data["duracion"])
+            data["fechaFin"] = data["fechaInicio"] + timedelta(minutes=data["duracion"])
+            data[CAMPO] = claves_busqueda(data, CitaCRUD.campos_busqueda)
+            numeros.append(numero)
+            docs.append(data)
+        self.insertar(CitaCRUD.citas, numeros, docs)
+
+    def importar(self, filas, tamanio: int = LOTE):
+        procesar = getattr(self, self.tipo)
+        for lote in lotes(filas, tamanio):
+            procesar(lote)
+            print(f"{self.tipo}: {self.insertadas} insertadas, {self.fallidas} con error", file=sys.stderr)
+        if self.insertadas:
+            # Con CACHE_REDIS_URL el aviso llega también a la aplicación en marcha
+            invalidar(*INVALIDA[self.tipo])
+        return self.insertadas, self.fallidas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Importa dueños, mascotas o citas desde CSV o JSONL. "
+                    "Las mascotas llevan la columna duenio (cédula o _id del dueño)."
+    )
+    parser.add_argument("tipo", choices=["duenios", "mascotas", "citas"])
+    parser.add_argument("archivo")
+    parser.add_argument("--formato", choices=["csv", "jsonl"], help="por defecto se toma de la extensión")
+    parser.add_argument("--lote", type=int, default=LOTE, help="filas por inserción")
+    parser.add_argument("--errores", help="archivo donde escribir los errores por fila (por defecto, stderr)")
+    args = parser.parse_args()
+
+    salida = open(args.errores, "w", encoding="utf-8") if args.errores else sys.stderr
+    try:
+        insertadas, fallidas = Importador(args.tipo, salida).importar(leer_filas(args.archivo, args.formato), args.lote)
+    finally:
+        if args.errores:
+            salida.close()
+    print(f"Listo: {insertadas} insertadas, {fallidas} con error.")
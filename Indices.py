@@ -0,0 +1,255 @@
+import argparse
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+from MongoDB import db, ACTUALIZADO
+from Busqueda import CAMPO as CAMPO_BUSQUEDA, reconstruir
+
+# Subir VERSION cada vez que se modifique INDICES o se registre una migración nueva,
+# así el arranque sabe que tiene que volver a aplicar el esquema.
+VERSION = 6
+
+meta = db["meta_esquema"]
+
+
+class Indice:
+
+    def __init__(self, nombre, claves, **opciones):
+
+        self.nombre = nombre
+        self.claves = claves
+        self.opciones = opciones
+
+    def coincide(self, info: dict):
+        if [tuple(k) for k in info.get("key", [])] != list(self.claves):
+            return False
+        return all(info.get(k) == v for k, v in self.opciones.items())
+
+
+INDICES = {
+    "registro_duenios": [
+        Indice("cedula_unica", [("cedula", ASCENDING)], unique=True),
+        Indice("busqueda", [(CAMPO_BUSQUEDA, ASCENDING)]),
+        Indice("actualizado", [(ACTUALIZADO, ASCENDING)]),
+    ],
+    "registro_mascotas": [
+        Indice("duenio", [("duenio_id", ASCENDING)]),
+        Indice("actualizado", [(ACTUALIZADO, ASCENDING)]),
+    ],
+    "registro_fichas": [
+        # Cubre el orden de MascotaCRUD.listar_fichas, que desempata por _id
+        Indice("mascota_fecha", [
+            ("mascota_id", ASCENDING), ("fecha", DESCENDING), ("_id", DESCENDING)
+        ]),
+    ],
+    "registro_citas": [
+        # También sirve para las consultas por (veterinario, fechaInicio) de la agenda
+        Indice("veterinario_fecha_fin", [
+            ("veterinario", ASCENDING), ("fechaInicio", ASCENDING), ("fechaFin", ASCENDING)
+        ]),
+        Indice("busqueda", [(CAMPO_BUSQUEDA, ASCENDING)]),
+        Indice("actualizado", [(ACTUALIZADO, ASCENDING)]),
+    ],
+    "registro_empleados": [
+        # estado primero: el rol se filtra con una regex sin ancla, que no puede usar el índice
+        Indice("estado_rol", [("estado", ASCENDING), ("rol", ASCENDING)]),
+        Indice("busqueda", [(CAMPO_BUSQUEDA, ASCENDING)]),
+        Indice("actualizado", [(ACTUALIZADO, ASCENDING)]),
+    ],
+    "registro_servicios": [
+        Indice("busqueda", [(CAMPO_BUSQUEDA, ASCENDING)]),
+        Indice("actualizado", [(ACTUALIZADO, ASCENDING)]),
+    ],
+}
+
+# Índices que existieron en versiones anteriores y se eliminan al aplicar
+OBSOLETOS = {
+    "registro_citas": ["veterinario_fecha"],
+    "registro_empleados": ["rol_estado"],
+}
+
+# Lista de (version, descripcion, funcion). Cada función recibe la base de datos
+# y debe poder ejecutarse más de una vez sin romper nada.
+MIGRACIONES = []
+
+
+def migracion(version: int, descripcion: str):
+    def registrar(funcion):
+        MIGRACIONES.append((version, descripcion, funcion))
+        MIGRACIONES.sort(key=lambda m: m[0])
+        return funcion
+    return registrar
+
+
+@migracion(2, "calcular las claves de búsqueda de los documentos existentes")
+def calcular_claves_busqueda(db):
+    # Import local: los CRUD cargan flet y no hacen falta para revisar índices
+    from Dueño import DuenioCRUD
+    from Empleados import EmpleadoCRUD
+    from Citas import CitaCRUD
+    from Servicios import ServicioCRUD
+
+    for crud, coleccion in [
+        (DuenioCRUD, DuenioCRUD.duenios),
+        (EmpleadoCRUD, EmpleadoCRUD.empleados),
+        (CitaCRUD, CitaCRUD.citas),
+        (ServicioCRUD, ServicioCRUD.servicios),
+    ]:
+        reconstruir(coleccion, crud.campos_busqueda)
+
+
+@migracion(3, "guardar fechaFin en las citas existentes")
+def calcular_fecha_fin(db):
+    # Se hace en el servidor con un pipeline de actualización; de paso se convierten
+    # las fechas guardadas como texto para que entren en las consultas por rango.
+    db["registro_citas"].update_many(
+        {"fechaFin": {"$exists": False}},
+        [
+            {"$set": {"fechaInicio": {"$toDate": "$fechaInicio"}}},
+            {"$set": {"fechaFin": {"$dateAdd": {
+                "startDate": "$fechaInicio",
+                "unit": "minute",
+                "amount": {"$toInt": "$duracion"},
+            }}}},
+        ],
+    )
+
+
+@migracion(4, "mover las fichas de cada mascota a registro_fichas")
+def separar_fichas(db):
+    from Dueño import MascotaCRUD
+
+    # Upsert por (mascota, posición en el arreglo): si se corta a mitad y se vuelve a correr
+    # no duplica fichas, y dos fichas iguales de la misma mascota siguen siendo dos
+    for mascota in db["registro_mascotas"].find({"fichas": {"$exists": True}}, {"fichas": 1}):
+        operaciones = []
+        for posicion, ficha in enumerate(mascota.get("fichas") or []):
+            doc = MascotaCRUD.documento_ficha(mascota["_id"], ficha)
+            clave = {"mascota_id": mascota["_id"], "_posicion": posicion}
+            operaciones.append(UpdateOne(clave, {"$setOnInsert": doc}, upsert=True))
+        if operaciones:
+            db["registro_fichas"].bulk_write(operaciones, ordered=False)
+        db["registro_mascotas"].update_one({"_id": mascota["_id"]}, {"$unset": {"fichas": ""}})
+    # La posición solo hacía falta mientras la mascota conservaba su arreglo
+    db["registro_fichas"].update_many({"_posicion": {"$exists": True}}, {"$unset": {"_posicion": ""}})
+
+
+def version_aplicada():
+    doc = meta.find_one({"_id": "indices"})
+    return doc.get("version", 0) if doc else 0
+
+
+def migracion_aplicada():
+    # Las migraciones se anotan aparte: un índice que falla no obliga a repetirlas
+    doc = meta.find_one({"_id": "indices"}) or {}
+    return doc.get("migracion", doc.get("version", 0))
+
+
+def revisar():
+    """Compara los índices declarados con los que existen en la base y devuelve las diferencias."""
+    deriva = []
+    for coleccion, declarados in INDICES.items():
+        existentes = db[coleccion].index_information()
+        nombres = {i.nombre for i in declarados}
+
+        for indice in declarados:
+            info = existentes.get(indice.nombre)
+            if info is None:
+                deriva.append((coleccion, indice.nombre, "falta"))
+            elif not indice.coincide(info):
+                deriva.append((coleccion, indice.nombre, "distinto"))
+
+        for nombre in existentes:
+            if nombre in OBSOLETOS.get(coleccion, []):
+                deriva.append((coleccion, nombre, "obsoleto"))
+            elif nombre != "_id_" and nombre not in nombres:
+                deriva.append((coleccion, nombre, "no declarado"))
+
+    version = version_aplicada()
+    if version != VERSION:
+        deriva.append(("meta_esquema", "version", f"aplicada {version}, esperada {VERSION}"))
+    return deriva
+
+
+def migrar():
+    # Cada migración se anota apenas termina: si una falla, las anteriores no se repiten
+    hecha = migracion_aplicada()
+    for numero, descripcion, funcion in MIGRACIONES:
+        if numero <= hecha:
+            continue
+        print(f"Migración {numero}: {descripcion}")
+        funcion(db)
+        meta.update_one({"_id": "indices"}, {"$set": {"migracion": numero}}, upsert=True)
+
+
+def aplicar():
+    """Crea los índices que falten, recrea los que cambiaron y corre las migraciones pendientes."""
+    errores = []
+    for coleccion, declarados in INDICES.items():
+        existentes = db[coleccion].index_information()
+        for indice in declarados:
+            info = existentes.get(indice.nombre)
+            if info is not None and indice.coincide(info):
+                continue
+            try:
+                if info is not None:
+                    db[coleccion].drop_index(indice.nombre)
+                db[coleccion].create_index(indice.claves, name=indice.nombre, **indice.opciones)
+                print(f"Índice {coleccion}.{indice.nombre} creado")
+            except OperationFailure as e:
+                errores.append((coleccion, indice.nombre, str(e)))
+
+        for nombre in OBSOLETOS.get(coleccion, []):
+            if nombre in existentes:
+                db[coleccion].drop_index(nombre)
+                print(f"Índice {coleccion}.{nombre} eliminado")
+
+    migrar()
+
+    if errores:
+        # No se marca la versión para que el próximo arranque vuelva a intentar los índices;
+        # las migraciones ya hechas quedaron anotadas y no se repiten
+        for coleccion, nombre, detalle in errores:
+            print(f"Error creando índice {coleccion}.{nombre}: {detalle}")
+    else:
+        meta.update_one(
+            {"_id": "indices"},
+            {"$set": {"version": VERSION, "actualizado": datetime.now()}},
+            upsert=True,
+        )
+    return errores
+
+
+def asegurar_migraciones():
+    # Se corre antes de abrir la app: las vistas dan por hecho fechaFin en las citas
+    # y las fichas en registro_fichas. Con todo al día es un solo find_one.
+    try:
+        if MIGRACIONES and migracion_aplicada() < MIGRACIONES[-1][0]:
+            migrar()
+    except Exception as e:
+        print("Error aplicando migraciones:", e)
+
+
+def asegurar_indices():
+    # Los índices pueden tardar en construirse: main.py lo corre en segundo plano,
+    # después de asegurar_migraciones. Un solo find_one si el esquema ya está al día.
+    try:
+        if version_aplicada() < VERSION:
+            aplicar()
+    except Exception as e:
+        print("Error aplicando índices:", e)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índices y migraciones de la base Veterinaria")
+    parser.add_argument("accion", choices=["aplicar", "revisar"])
+    args = parser.parse_args()
+
+    if args.accion == "aplicar":
+        aplicar()
+
+    deriva = revisar()
+    if not deriva:
+        print(f"Esquema al día (versión {VERSION}).")
+    for coleccion, nombre, estado in deriva:
+        print(f"{coleccion}.{nombre}: {estado}")
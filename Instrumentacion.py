@@ -0,0 +1,332 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from dotenv import load_dotenv
+from pymongo.monitoring import CommandListener
+
+load_dotenv()
+
+# Se activa con INSTRUMENTACION=1 en el .env. Apagado, y sin registro de consultas lentas,
+# no se registra el listener y los decoradores devuelven la función tal cual.
+ACTIVO = os.getenv("INSTRUMENTACION", "0").lower() in ("1", "true", "si", "sí")
+MAXIMO_ACCIONES = int(os.getenv("INSTRUMENTACION_ACCIONES", "200"))
+
+# Registro de consultas lentas: con CONSULTAS_LENTAS_MS > 0 toda consulta que tarde más
+# queda en un log JSON rotativo, y una muestra de ellas se acompaña con su explain().
+LENTAS_MS = float(os.getenv("CONSULTAS_LENTAS_MS", "0"))
+LENTAS_MUESTREO = float(os.getenv("CONSULTAS_LENTAS_MUESTREO", "0.1"))
+LENTAS_ARCHIVO = os.getenv("CONSULTAS_LENTAS_ARCHIVO", "consultas_lentas.log")
+# La misma consulta (origen, colección y comando) se explica como máximo una vez por período
+LENTAS_EXPLICAR_CADA_S = float(os.getenv("CONSULTAS_LENTAS_EXPLICAR_CADA_S", "60"))
+
+# Las acciones se arman si hace falta cualquiera de los dos registros
+MEDIR = ACTIVO or LENTAS_MS > 0
+
+log = logging.getLogger("veterinaria.comandos")
+if ACTIVO and not log.handlers:
+    _consola = logging.StreamHandler()
+    _consola.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    log.addHandler(_consola)
+    log.setLevel(logging.INFO)
+
+log_lentas = logging.getLogger("veterinaria.lentas")
+if LENTAS_MS > 0 and not log_lentas.handlers:
+    _archivo = RotatingFileHandler(LENTAS_ARCHIVO, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8")
+    _archivo.setFormatter(logging.Formatter("%(message)s"))
+    log_lentas.addHandler(_archivo)
+    log_lentas.setLevel(logging.INFO)
+    log_lentas.propagate = False
+
+# Comandos del driver que no salen de la aplicación
+IGNORADOS = {
+    "ping", "hello", "isMaster", "ismaster", "buildInfo", "endSessions",
+    "saslStart", "saslContinue", "killCursors", "explain",
+}
+
+# Comandos que admiten explain y campos que agrega el driver y no forman parte de la consulta
+EXPLICABLES = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+CAMPOS_DRIVER = {"lsid", "txnNumber", "autocommit", "startTransaction", "apiVersion", "apiStrict",
+                 "apiDeprecationErrors", "readConcern", "writeConcern"}
+
+# Módulos cuyo método se anota como origen del comando. Busqueda.py no está porque
+# es un helper: el origen es el CRUD que lo llamó.
+MODULOS = {
+    "Dueño.py", "Empleados.py", "Citas.py", "Servicios.py", "Resolutor.py",
+    "Ngramas.py", "Indices.py", "Importar.py", "Sincronizacion.py",
+}
+
+_accion = contextvars.ContextVar("accion", default=None)
+
+
+def origen():
+    frame = sys._getframe(2)
+    while frame is not None:
+        if os.path.basename(frame.f_code.co_filename) in MODULOS:
+            # co_qualname existe desde Python 3.11; antes alcanza con el nombre de la función
+            return getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+
+def limpiar_comando(comando: dict):
+    return {k: v for k, v in comando.items() if not k.startswith("$") and k not in CAMPOS_DRIVER}
+
+
+def resumir_plan(explicacion: dict):
+    """Junta las etapas e índices de los winningPlan que aparezcan en la respuesta de explain
+    (en un aggregate pueden estar dentro de $cursor o de cada shard)."""
+    etapas, indices = [], []
+
+    def recorrer(nodo, en_plan=False):
+        if isinstance(nodo, dict):
+            if en_plan:
+                if "stage" in nodo:
+                    etapas.append(nodo["stage"])
+                if "indexName" in nodo:
+                    indices.append(nodo["indexName"])
+            for clave, valor in nodo.items():
+                recorrer(valor, en_plan or clave in ("winningPlan", "queryPlan"))
+        elif isinstance(nodo, list):
+            for valor in nodo:
+                recorrer(valor, en_plan)
+
+    recorrer(explicacion)
+    return {"etapas": etapas, "indices": indices, "collscan": "COLLSCAN" in etapas}
+
+
+def documentos(respuesta: dict):
+    cursor = respuesta.get("cursor")
+    if cursor is not None:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "value" in respuesta:
+        return 0 if respuesta["value"] is None else 1
+    return respuesta.get("n")
+
+
+class Accion:
+    """Comandos que costó una acción de la interfaz, por ejemplo abrir el detalle de un dueño."""
+
+    def __init__(self, nombre: str):
+
+        self.nombre = nombre
+        self.comandos = []
+        self.inicio = time.perf_counter()
+        self.ms = None
+
+    def resumen(self):
+        conteo = defaultdict(int)
+        for comando in self.comandos:
+            conteo[comando["comando"]] += 1
+        partes = ", ".join(f"{n} {c}" for c, n in sorted(conteo.items())) or "sin consultas"
+        base = sum(c["ms"] for c in self.comandos)
+        return f"{self.nombre}: {partes}, {self.ms:.0f} ms (base {base:.0f} ms)"
+
+    def como_fila(self):
+        return {
+            "accion": self.nombre,
+            "comandos": len(self.comandos),
+            "documentos": sum(c["documentos"] or 0 for c in self.comandos),
+            "base_ms": round(sum(c["ms"] for c in self.comandos), 1),
+            "total_ms": round(self.ms, 1),
+        }
+
+
+class MonitorComandos(CommandListener):
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.pendientes = {}
+        self.totales = defaultdict(lambda: {"comandos": 0, "ms": 0.0, "documentos": 0, "errores": 0})
+        self.acciones = deque(maxlen=MAXIMO_ACCIONES)
+        # Un solo hilo para los explain y el log de lentas, fuera del camino de la consulta
+        self.ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="consultas-lentas")
+        self.explicadas = {}
+
+    def started(self, event):
+        if event.command_name in IGNORADOS:
+            return
+        coleccion = event.command.get(event.command_name)
+        if not isinstance(coleccion, str):
+            coleccion = event.command.get("collection")
+        # Solo se guarda una referencia al comando; se copia si la consulta resulta lenta
+        comando = event.command if LENTAS_MS > 0 and event.command_name in EXPLICABLES else None
+        with self.lock:
+            self.pendientes[(event.connection_id, event.request_id)] = (
+                coleccion, origen(), _accion.get(), comando, event.database_name
+            )
+
+    def succeeded(self, event):
+        self._terminar(event, documentos(event.reply), None)
+
+    def failed(self, event):
+        self._terminar(event, None, str(event.failure))
+
+    def _terminar(self, event, docs, error):
+        with self.lock:
+            datos = self.pendientes.pop((event.connection_id, event.request_id), None)
+            if datos is None:
+                return
+            coleccion, quien, accion_actual, comando, base = datos
+            registro = {
+                "comando": event.command_name,
+                "coleccion": coleccion,
+                "ms": event.duration_micros / 1000,
+                "documentos": docs,
+                "origen": quien,
+                "error": error,
+            }
+            total = self.totales[(quien, event.command_name, coleccion)]
+            total["comandos"] += 1
+            total["ms"] += registro["ms"]
+            total["documentos"] += docs or 0
+            total["errores"] += error is not None
+            if accion_actual is not None:
+                accion_actual.comandos.append(registro)
+        log.debug("%s %s.%s %.1f ms docs=%s %s", quien, coleccion, event.command_name, registro["ms"], docs, error or "")
+
+        if LENTAS_MS > 0 and registro["ms"] >= LENTAS_MS:
+            explicar = comando is not None and self._toca_explicar((quien, coleccion, event.command_name))
+            self.ejecutor.submit(
+                self._registrar_lenta, registro, limpiar_comando(comando or {}), base,
+                accion_actual.nombre if accion_actual else None, explicar,
+            )
+
+    def _toca_explicar(self, clave):
+        if random.random() >= LENTAS_MUESTREO:
+            return False
+        ahora = time.monotonic()
+        with self.lock:
+            if ahora - self.explicadas.get(clave, float("-inf")) < LENTAS_EXPLICAR_CADA_S:
+                return False
+            self.explicadas[clave] = ahora
+        return True
+
+    def _registrar_lenta(self, registro: dict, comando: dict, base: str, nombre_accion: str, explicar: bool):
+        entrada = {
+            "fecha": datetime.now().isoformat(timespec="milliseconds"),
+            **registro,
+            "ms": round(registro["ms"], 1),
+            "accion": nombre_accion,
+            "base": base,
+            "consulta": comando or None,
+        }
+        if explicar:
+            # Import local: MongoDB importa este módulo. El explain pasa por el listener
+            # pero "explain" está en IGNORADOS, así que no se cuenta ni se vuelve a explicar.
+            from MongoDB import obtener_cliente
+            try:
+                explicacion = obtener_cliente()[base].command({"explain": comando, "verbosity": "queryPlanner"})
+                entrada["plan"] = resumir_plan(explicacion)
+            except Exception as e:
+                entrada["plan"] = {"error": str(e)}
+        try:
+            log_lentas.info(json.dumps(entrada, default=str, ensure_ascii=False))
+        except Exception as e:
+            print("Error registrando consulta lenta:", e)
+
+    def cerrar_accion(self, accion_actual: Accion):
+        accion_actual.ms = (time.perf_counter() - accion_actual.inicio) * 1000
+        with self.lock:
+            self.acciones.append(accion_actual)
+        log.info(accion_actual.resumen())
+
+    def estadisticas(self):
+        with self.lock:
+            filas = [
+                {"origen": o or "-", "comando": c, "coleccion": col or "-", **{k: round(v, 1) for k, v in t.items()}}
+                for (o, c, col), t in self.totales.items()
+            ]
+        return sorted(filas, key=lambda f: f["ms"], reverse=True)
+
+    def acciones_recientes(self):
+        with self.lock:
+            return [a.como_fila() for a in reversed(self.acciones)]
+
+
+monitor = MonitorComandos()
+
+
+class _Medicion:
+
+    def __init__(self, nombre: str):
+
+        self.nombre = nombre
+        self.token = None
+
+    def __enter__(self):
+        # Una acción dentro de otra se cuenta en la de afuera
+        if MEDIR and _accion.get() is None:
+            self.accion = Accion(self.nombre)
+            self.token = _accion.set(self.accion)
+        return self
+
+    def __exit__(self, *exc):
+        if self.token is not None:
+            _accion.reset(self.token)
+            self.token = None
+            monitor.cerrar_accion(self.accion)
+        return False
+
+    def __call__(self, funcion):
+        if not MEDIR:
+            return funcion
+        nombre = self.nombre
+
+        if inspect.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura_async(*args, **kwargs):
+                with _Medicion(nombre):
+                    return await funcion(*args, **kwargs)
+            return envoltura_async
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with _Medicion(nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+
+
+def accion(nombre: str):
+    """Agrupa los comandos que se ejecuten adentro bajo una acción de la interfaz.
+    Sirve como `with accion("abrir dueños"):` o como decorador `@accion("abrir detalle de dueño")`."""
+    return _Medicion(nombre)
+
+
+def mostrarView():
+    # Import local: MongoDB importa este módulo para registrar el listener
+    import flet as ft
+    from plantilla import crear_tabla_manual
+    from MongoDB import metricas_pool
+
+    if not ACTIVO:
+        return ft.Text("Instrumentación apagada (INSTRUMENTACION=1 en el .env).", size=16)
+
+    pool = metricas_pool()
+    salud = pool.pop("salud")
+    return ft.Column(
+        [
+            ft.Text("Diagnóstico", size=25, weight=ft.FontWeight.BOLD),
+            ft.Text(
+                f"Pool: {pool}  ·  Base: {'ok' if salud['ok'] else salud['error']}"
+                f" ({salud['latencia_ms']} ms)"
+            ),
+            ft.Text("Acciones recientes", size=18, weight=ft.FontWeight.BOLD),
+            crear_tabla_manual(monitor.acciones_recientes(), lambda e, i: None),
+            ft.Text("Comandos por origen", size=18, weight=ft.FontWeight.BOLD),
+            crear_tabla_manual(monitor.estadisticas(), lambda e, i: None),
+        ],
+        scroll=ft.ScrollMode.AUTO,
+        expand=True,
+    )
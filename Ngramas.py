@@ -0,0 +1,169 @@
+import os
+import threading
+from collections import defaultdict
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo.collection import Collection
+import Cache
+from Busqueda import TAM_PAGINA, claves_busqueda, leer_token, palabras, paginar
+
+load_dotenv()
+
+# Se activa con BUSQUEDA_EN_MEMORIA=1 en el .env. Apagado, todo sigue yendo a Mongo.
+ACTIVO = os.getenv("BUSQUEDA_EN_MEMORIA", "0").lower() in ("1", "true", "si", "sí")
+
+
+def trigramas(texto: str):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceTrigramas:
+    """`campos` son los que se devuelven en cada resultado; `busqueda` los que se buscan,
+    los mismos campos_busqueda del CRUD, para coincidir con Busqueda.buscar_documentos."""
+
+    def __init__(self, coleccion: Collection, campos: list[str], busqueda: list[str] = None):
+
+        self.coleccion = coleccion
+        self.campos = campos
+        self.busqueda = busqueda or campos
+        self.proyeccion = {c: 1 for c in {*campos, *self.busqueda}}
+        self.docs = {}
+        # _id -> claves de búsqueda, como las que Busqueda guarda en CAMPO
+        self.claves = {}
+        self.postings = defaultdict(set)
+        self.construido = False
+        self.lock = threading.RLock()
+        # Con varios procesos, cada escritura se avisa a los demás índices de la misma colección
+        Cache.al_invalidar(self._remoto)
+
+    def _construir(self):
+        with self.lock:
+            if self.construido:
+                return
+            for doc in self.coleccion.find({}, self.proyeccion):
+                self._agregar(doc)
+            self.construido = True
+
+    def _agregar(self, doc: dict):
+        _id = ObjectId(doc["_id"])
+        self._quitar(_id)
+        claves = claves_busqueda(doc, self.busqueda)
+        self.docs[_id] = {c: doc[c] for c in self.campos if c in doc}
+        self.claves[_id] = claves
+        for t in self._trigramas(claves):
+            self.postings[t].add(_id)
+
+    def _trigramas(self, claves):
+        return set().union(*(trigramas(c) for c in claves))
+
+    def _quitar(self, _id: ObjectId):
+        claves = self.claves.pop(_id, None)
+        self.docs.pop(_id, None)
+        if claves is None:
+            return
+        for t in self._trigramas(claves):
+            ids = self.postings.get(t)
+            if ids is not None:
+                ids.discard(_id)
+                if not ids:
+                    del self.postings[t]
+
+    def _prefijo(self):
+        return f"indice:{self.coleccion.name}:"
+
+    def _avisar(self, _id):
+        if Cache.compartida is not None:
+            Cache.compartida.invalidar(f"{self._prefijo()}{_id}")
+
+    def _remoto(self, etiquetas):
+        if not self.construido:
+            return
+        prefijo = self._prefijo()
+        for etiqueta in etiquetas:
+            if etiqueta.startswith(prefijo):
+                self._releer(etiqueta[len(prefijo):])
+
+    def _releer(self, _id):
+        with self.lock:
+            if not self.construido:
+                return
+            doc = self.coleccion.find_one({"_id": ObjectId(_id)}, self.proyeccion)
+            if doc:
+                self._agregar(doc)
+            else:
+                self._quitar(ObjectId(_id))
+
+    # Los métodos públicos de escritura no hacen nada si el índice todavía no se construyó:
+    # la primera búsqueda lo carga completo desde Mongo.
+    def agregar(self, doc: dict):
+        with self.lock:
+            if self.construido:
+                self._agregar(doc)
+        self._avisar(doc["_id"])
+
+    def quitar(self, _id):
+        with self.lock:
+            if self.construido:
+                self._quitar(ObjectId(_id))
+        self._avisar(_id)
+
+    def sincronizar(self, _id, doc: dict = None):
+        # Cambio visto en la base por Sincronizacion.py: cada proceso lo ve por su cuenta, no se avisa
+        with self.lock:
+            if not self.construido:
+                return
+            if doc:
+                self._agregar(doc)
+            else:
+                self._quitar(ObjectId(_id))
+
+    def vaciar(self):
+        # La próxima búsqueda lo vuelve a cargar completo
+        with self.lock:
+            self.docs.clear()
+            self.claves.clear()
+            self.postings.clear()
+            self.construido = False
+
+    def buscar(self, prompt: str = "", despues: str = None, limite: int = TAM_PAGINA):
+        """Devuelve (pagina, token) con copias de los documentos. Coincide, ordena y pagina igual
+        que Busqueda.buscar_documentos: cada palabra del prompt es prefijo de alguna clave, y los
+        resultados van por puntaje (palabras que coinciden completas) y luego más nuevos primero."""
+        self._construir()
+        terminos = palabras(prompt)
+        puntaje_token, ultimo = leer_token(despues)
+
+        with self.lock:
+            if not terminos:
+                encontrados = sorted((_id for _id in self.docs if ultimo is None or _id < ultimo), reverse=True)
+                pagina, token = paginar(encontrados[:limite + 1] if limite else encontrados, limite, str)
+                return [{**self.docs[_id], "_id": str(_id)} for _id in pagina], token
+
+            # Los trigramas solo descartan; las palabras de menos de tres letras no filtran
+            candidatos = None
+            for termino in terminos:
+                for t in trigramas(termino):
+                    ids = self.postings.get(t, set())
+                    candidatos = set(ids) if candidatos is None else candidatos & ids
+                    if not candidatos:
+                        return [], None
+            if candidatos is None:
+                candidatos = self.docs.keys()
+
+            buscados = set(terminos)
+            encontrados = []
+            for _id in candidatos:
+                claves = self.claves[_id]
+                if not all(any(c.startswith(t) for c in claves) for t in terminos):
+                    continue
+                puntaje = sum(1 for c in claves if c in buscados)
+                if ultimo is not None and (
+                    _id >= ultimo if puntaje_token is None else (puntaje, _id) >= (puntaje_token, ultimo)
+                ):
+                    continue
+                encontrados.append((puntaje, _id))
+            encontrados.sort(reverse=True)
+            pagina, token = paginar(
+                encontrados[:limite + 1] if limite else encontrados, limite, lambda e: f"{e[0]}:{e[1]}"
+            )
+            return [{**self.docs[_id], "_id": str(_id)} for _, _id in pagina], token
@@ -0,0 +1,101 @@
+import asyncio
+from bson import ObjectId
+from MongoDB import db, db_async
+
+# tipo -> (colección, campo alternativo con el que también se guarda la referencia).
+# Las citas guardan el dueño por _id o por cédula, y la mascota por _id o ya por nombre.
+FUENTES = {
+    "duenios": ("registro_duenios", "cedula"),
+    "mascotas": ("registro_mascotas", None),
+}
+
+
+class ResolutorNombres:
+    """Traduce referencias a nombres con una sola consulta $in por colección.
+
+    Se crea uno por vista: lo ya resuelto queda en memoria y no se vuelve a pedir,
+    por ejemplo al cambiar de semana en la agenda."""
+
+    def __init__(self):
+
+        self.memo = {tipo: {} for tipo in FUENTES}
+
+    def _pendientes(self, tipo: str, valores):
+        _, alternativo = FUENTES[tipo]
+        memo = self.memo[tipo]
+        ids, textos = set(), set()
+        for valor in valores:
+            if valor is None:
+                continue
+            valor = str(valor)
+            if not valor or valor in memo:
+                continue
+            if ObjectId.is_valid(valor):
+                ids.add(valor)
+            elif alternativo:
+                textos.add(valor)
+            else:
+                memo[valor] = valor
+        return ids, textos
+
+    def _filtro(self, tipo: str, ids, textos):
+        _, alternativo = FUENTES[tipo]
+        condiciones = []
+        if ids:
+            condiciones.append({"_id": {"$in": [ObjectId(i) for i in ids]}})
+        if textos:
+            condiciones.append({alternativo: {"$in": list(textos)}})
+        proyeccion = {"nombre": 1, **({alternativo: 1} if alternativo else {})}
+        return {"$or": condiciones}, proyeccion
+
+    def _guardar(self, tipo: str, docs, ids, textos):
+        _, alternativo = FUENTES[tipo]
+        memo = self.memo[tipo]
+        for doc in docs:
+            nombre = doc.get("nombre", "Sin nombre")
+            memo[str(doc["_id"])] = nombre
+            if alternativo and doc.get(alternativo) is not None:
+                memo[str(doc[alternativo])] = nombre
+        # Lo que no existe se muestra tal cual y tampoco se vuelve a consultar
+        for valor in ids | textos:
+            memo.setdefault(valor, valor)
+
+    def nombres(self, tipo: str, valores) -> dict:
+        ids, textos = self._pendientes(tipo, valores)
+        if ids or textos:
+            filtro, proyeccion = self._filtro(tipo, ids, textos)
+            self._guardar(tipo, db[FUENTES[tipo][0]].find(filtro, proyeccion), ids, textos)
+        return self.memo[tipo]
+
+    async def nombres_async(self, tipo: str, valores) -> dict:
+        ids, textos = self._pendientes(tipo, valores)
+        if ids or textos:
+            filtro, proyeccion = self._filtro(tipo, ids, textos)
+            docs = await db_async[FUENTES[tipo][0]].find(filtro, proyeccion).to_list()
+            self._guardar(tipo, docs, ids, textos)
+        return self.memo[tipo]
+
+    @staticmethod
+    def _asignar(docs: list[dict], campos: dict, memos: dict, sufijo: str):
+        for doc in docs:
+            for campo, tipo in campos.items():
+                valor = str(doc.get(campo, ""))
+                doc[campo + sufijo] = memos[tipo].get(valor, valor)
+        return docs
+
+    def adjuntar(self, docs: list[dict], campos: dict, sufijo: str = "_nombre"):
+        """campos es {campo del documento: tipo}, por ejemplo {"duenio": "duenios"}.
+        Agrega campo + sufijo con el nombre; con sufijo="" reemplaza el valor."""
+        memos = {tipo: self.nombres(tipo, [d.get(c) for d in docs for c in campos if campos[c] == tipo])
+                 for tipo in set(campos.values())}
+        return self._asignar(docs, campos, memos, sufijo)
+
+    async def adjuntar_async(self, docs: list[dict], campos: dict, sufijo: str = "_nombre"):
+        # Las colecciones no dependen entre sí: se consultan al mismo tiempo
+        tipos = list(set(campos.values()))
+        resueltos = await asyncio.gather(*[
+            self.nombres_async(tipo, [d.get(c) for d in docs for c in campos if campos[c] == tipo])
+            for tipo in tipos
+        ])
+        memos = dict(zip(tipos, resueltos))
+        return self._asignar(docs, campos, memos, sufijo)
@@ -1,53 +1,82 @@
+import asyncio
 from pydantic import ValidationError
 
 from fastapi.encoders import jsonable_encoder
 from schemas import ServicioBase
-from MongoDB import db
+from MongoDB import db, db_async, SELLO, sellar
 import flet as ft
 from plantilla import crear_tabla_manual
+from Busqueda import CAMPO, TAM_PAGINA, buscar_documentos, buscar_documentos_async, claves_busqueda, filtro_en_memoria
+import Ngramas
+from Ngramas import IndiceTrigramas
+from Resolutor import ResolutorNombres
+from Cache import invalidar
+from Sesion import notificar_cambio
 
 
 class ServicioCRUD:
     servicios = db["registro_servicios"]
+    servicios_async = db_async["registro_servicios"]
+    campos_busqueda = ["nombre", "descripcion", "veterinario", "duenio"]
+    # Campos que muestra la tabla; el resto no viaja desde la base
+    campos_tabla = ["nombre", "descripcion", "veterinario", "duenio", "pago"]
+    proyeccion_tabla = {c: 1 for c in campos_tabla}
+    indice = IndiceTrigramas(servicios, campos_tabla, campos_busqueda)
+    referencias = {"duenio": "duenios"}
 
     @staticmethod
     def crear(servicio: ServicioBase):
         data = jsonable_encoder(servicio)
-        resultado = ServicioCRUD.servicios.insert_one(data)
-        return str(resultado.inserted_id)
+        data[CAMPO] = claves_busqueda(data, ServicioCRUD.campos_busqueda)
+        resultado = ServicioCRUD.servicios.insert_one(sellar(data))
+        ServicioCRUD.indice.agregar({**data, "_id": resultado.inserted_id})
+        invalidar("datos:servicios")
+        return {**data, "_id": str(resultado.inserted_id)}
 
     @staticmethod
-    def buscar(prompt: str = ""):
-        if not prompt.strip():
-            resultados = list(ServicioCRUD.servicios.find())
-        else:
-            primer_doc = ServicioCRUD.servicios.find_one()
-            if not primer_doc:
-                return []
-
-            regex = {"$regex": prompt, "$options": "i"}
-            condiciones = []
-            for campo in primer_doc:
-                if campo == "_id":
-                    continue
-                condiciones.append({campo: regex})
-
-            resultados = list(ServicioCRUD.servicios.find({"$or": condiciones}))
+    def buscar(prompt: str = "", despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+        resultados, token = buscar_documentos(ServicioCRUD.servicios, prompt, despues, limite, proyeccion)
 
         for doc in resultados:
             doc["_id"] = str(doc["_id"])
-        return resultados
+        return resultados, token
+
+    @staticmethod
+    def buscar_tabla(prompt: str = "", despues: str = None):
+        return ServicioCRUD.buscar(prompt, despues, proyeccion=ServicioCRUD.proyeccion_tabla)
 
     @staticmethod
     def mostrarView(busqueda: str = ""):
-        datos = ServicioCRUD.buscar(busqueda)
-        return crear_tabla_manual(
+        buscar = ServicioCRUD.indice.buscar if Ngramas.ACTIVO else ServicioCRUD.buscar_tabla
+        resolutor = ResolutorNombres()
+
+        def fuente(busqueda, despues=None):
+            # El dueño se guarda como cédula o _id; la tabla muestra el nombre
+            datos, token = buscar(busqueda, despues)
+            return resolutor.adjuntar(datos, ServicioCRUD.referencias, sufijo=""), token
+
+        datos, token = fuente(busqueda)
+        tabla = crear_tabla_manual(
             datos,
             lambda e, i: print(
                 f"Servicio {i} seleccionado"
             ),  # si quieres, puedes cambiar esto luego
             [],
+            token=token,
+            cargar_mas=lambda t: fuente(busqueda, t),
+            filtro=filtro_en_memoria(busqueda),
         )
+        return ServicioCRUD.con_nombres(tabla, resolutor)
+
+    @staticmethod
+    def con_nombres(tabla, resolutor: ResolutorNombres):
+        # Las filas que llegan de los CRUD traen la cédula del dueño; la tabla muestra el nombre
+        aplicar = tabla.data
+        if callable(aplicar):
+            tabla.data = lambda operacion, doc: aplicar(
+                operacion, resolutor.adjuntar([dict(doc)], ServicioCRUD.referencias, sufijo="")[0]
+            )
+        return tabla
 
     @staticmethod
     def crearView(page, duenio: str, veterinario: str):
@@ -90,8 +119,9 @@ class ServicioCRUD:
                     "pago": float(campos["pago"].value),
                 }
                 servicio = ServicioBase(**data)
-                ServicioCRUD.crear(servicio)
+                creado = ServicioCRUD.crear(servicio)
                 cerrar_bs()
+                notificar_cambio(page, "servicios", "crear", creado)
 
             except ValidationError as ve:
                 error.value = ve.errors()[0]["msg"]
@@ -140,3 +170,40 @@ class ServicioCRUD:
 
         page.overlay.append(bs)
         page.update()
+
+    # Variantes async: las mismas operaciones sobre el cliente asíncrono,
+    # para que los handlers async de flet esperen los datos sin bloquear la sesión.
+
+    @staticmethod
+    async def buscar_async(prompt: str = "", despues: str = None, limite: int = TAM_PAGINA, proyeccion: dict = None):
+        resultados, token = await buscar_documentos_async(ServicioCRUD.servicios_async, prompt, despues, limite, proyeccion)
+
+        for doc in resultados:
+            doc["_id"] = str(doc["_id"])
+        return resultados, token
+
+    @staticmethod
+    async def mostrarView_async(busqueda: str = ""):
+        if Ngramas.ACTIVO:
+            # La primera búsqueda carga el índice desde Mongo: se hace fuera del loop
+            datos, token = await asyncio.to_thread(ServicioCRUD.indice.buscar, busqueda)
+        else:
+            datos, token = await ServicioCRUD.buscar_async(busqueda, proyeccion=ServicioCRUD.proyeccion_tabla)
+        resolutor = ResolutorNombres()
+        await resolutor.adjuntar_async(datos, ServicioCRUD.referencias, sufijo="")
+        # Las páginas siguientes se piden desde el handler de scroll, que flet corre en un hilo
+        buscar = ServicioCRUD.indice.buscar if Ngramas.ACTIVO else ServicioCRUD.buscar_tabla
+
+        def fuente(busqueda, despues=None):
+            datos, token = buscar(busqueda, despues)
+            return resolutor.adjuntar(datos, ServicioCRUD.referencias, sufijo=""), token
+
+        tabla = crear_tabla_manual(
+            datos,
+            lambda e, i: print(f"Servicio {i} seleccionado"),
+            [],
+            token=token,
+            cargar_mas=lambda t: fuente(busqueda, t),
+            filtro=filtro_en_memoria(busqueda),
+        )
+        return ServicioCRUD.con_nombres(tabla, resolutor)
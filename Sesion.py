@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import Cache
+
+# Vistas armadas que cada sesión guarda para volver a ellas sin consultar la base
+MAXIMO_VISTAS = int(os.getenv("VISTAS_EN_CACHE", "8"))
+
+# Sesiones abiertas en este proceso, por page.session_id
+sesiones = {}
+_lock = threading.Lock()
+# Tema de page.pubsub por el que cada sesión avisa sus cambios a las demás del proceso
+TEMA_CAMBIOS = "cambios"
+# Escrituras de este proceso que ya se avisaron por pubsub: (coleccion, _id) -> vencimiento.
+# Sincronizacion.py las reconoce cuando vuelven desde la base y no las aplica otra vez.
+PROPIOS_SEGUNDOS = float(os.getenv("SINCRONIZACION_PROPIOS_SEGUNDOS", "30"))
+propios = {}
+
+
+class Sesion:
+    """Estado de una pestaña del navegador. En modo WEB_BROWSER todas las pestañas comparten
+    el proceso, así que nada de esto puede vivir en variables globales de main.py."""
+
+    def __init__(self, page):
+
+        self.page = page
+        self.id = page.session_id
+        self.vista = "dueños"
+        self.busqueda = ""
+        self.tarea_busqueda = None
+        self.secuencia = 0
+        # Control de la vista que se está mostrando y la colección de la que viene
+        self.contenido = None
+        self.coleccion = None
+        # Lo asigna main: vuelve a armar la vista actual desde la base
+        self.recargar = None
+        # (vista, búsqueda) -> (etiquetas, sellos, creada, control)
+        self.vistas = OrderedDict()
+        self.clave = None
+
+    def cancelar_busqueda(self):
+        # Sube la secuencia para que un resultado que ya venía en camino se descarte
+        self.secuencia += 1
+        if self.tarea_busqueda is not None and not self.tarea_busqueda.done():
+            self.tarea_busqueda.cancel()
+        return self.secuencia
+
+    def vigente(self, secuencia: int):
+        return secuencia == self.secuencia
+
+    def vista_guardada(self, clave, sellos):
+        """El control guardado para esa vista y búsqueda, si ninguna de las colecciones
+        de las que depende cambió desde que se armó y no pasó CACHE_TTL."""
+        entrada = self.vistas.get(clave)
+        if entrada is None:
+            return None
+        _, sellos_guardados, creada, contenido = entrada
+        # Sin Redis, los cambios de otros procesos no mueven los sellos: el TTL los acota
+        if sellos_guardados != sellos or time.monotonic() - creada > Cache.TTL:
+            del self.vistas[clave]
+            return None
+        self.vistas.move_to_end(clave)
+        return contenido
+
+    def guardar_vista(self, clave, etiquetas, sellos, contenido):
+        # Los sellos se toman antes de consultar: lo que cambie mientras tanto deja la entrada vieja
+        self.vistas[clave] = (etiquetas, sellos, time.monotonic(), contenido)
+        self.vistas.move_to_end(clave)
+        while len(self.vistas) > MAXIMO_VISTAS:
+            self.vistas.popitem(last=False)
+
+    def aplicar_cambio(self, coleccion: str, operacion: str, doc: dict):
+        """Lleva un crear/actualizar/eliminar a la vista abierta: se toca solo la fila o el
+        bloque afectado, y se vuelve a armar la vista únicamente si eso no alcanza."""
+        if coleccion != self.coleccion:
+            return
+        aplicar = getattr(self.contenido, "data", None)
+        if callable(aplicar) and aplicar(operacion, doc):
+            # La vista abierta ya refleja el cambio: su entrada sigue sirviendo
+            entrada = self.vistas.get(self.clave)
+            if entrada is not None and entrada[3] is self.contenido:
+                self.vistas[self.clave] = (entrada[0], Cache.sellos(*entrada[0]), entrada[2], entrada[3])
+            return
+        if self.recargar is not None:
+            self.recargar()
+
+    def recibir(self, tema: str, evento: dict):
+        # flet lo llama en un hilo aparte con el cambio que hizo otra sesión
+        self.aplicar_cambio(evento["coleccion"], evento["operacion"], evento["doc"])
+
+    def cerrar(self):
+        self.cancelar_busqueda()
+        self.vistas.clear()
+        with _lock:
+            sesiones.pop(self.id, None)
+
+
+def abrir(page):
+    sesion = Sesion(page)
+    with _lock:
+        sesiones[sesion.id] = sesion
+    page.on_close = lambda e: sesion.cerrar()
+    # flet da de baja la suscripción cuando se cierra la página
+    page.pubsub.subscribe_topic(TEMA_CAMBIOS, sesion.recibir)
+    return sesion
+
+
+def notificar_cambio(page, coleccion: str, operacion: str, doc: dict):
+    """operacion es "crear", "actualizar" o "eliminar"; doc es lo que devolvió el CRUD.
+    Se aplica en la sesión que hizo el cambio y se envía a las demás, que lo aplican
+    sobre sus vistas abiertas sin volver a consultar la base."""
+    if operacion == "eliminar":
+        # Para sacar la fila alcanza con el _id
+        doc = {"_id": doc["_id"]}
+    ahora = time.monotonic()
+    with _lock:
+        for clave in [c for c, vence in propios.items() if vence < ahora]:
+            del propios[clave]
+        propios[(coleccion, str(doc["_id"]))] = ahora + PROPIOS_SEGUNDOS
+    sesion = sesiones.get(page.session_id)
+    if sesion is not None:
+        sesion.aplicar_cambio(coleccion, operacion, doc)
+    page.pubsub.send_others_on_topic(
+        TEMA_CAMBIOS, {"coleccion": coleccion, "operacion": operacion, "doc": doc}
+    )
+
+
+def es_propio(coleccion: str, _id) -> bool:
+    """True si el cambio lo hizo hace poco una sesión de este proceso. Se consume una sola vez."""
+    with _lock:
+        vence = propios.pop((coleccion, str(_id)), None)
+    return vence is not None and vence >= time.monotonic()
+
+
+def aplicar_en_todas(coleccion: str, operacion: str, doc: dict):
+    """Un cambio que no salió de ninguna pestaña de este proceso (lo trae Sincronizacion.py)."""
+    with _lock:
+        abiertas = list(sesiones.values())
+    for sesion in abiertas:
+        try:
+            sesion.aplicar_cambio(coleccion, operacion, doc)
+        except Exception as e:
+            print(f"Error aplicando un cambio en la sesión {sesion.id}:", e)
+
+
+def recargar_todas(coleccion: str):
+    # Para cambios en bloque, donde tocar fila por fila no conviene
+    with _lock:
+        abiertas = [s for s in sesiones.values() if s.coleccion == coleccion]
+    for sesion in abiertas:
+        if sesion.recargar is not None:
+            sesion.recargar()
@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+from MongoDB import db, ACTUALIZADO
+import Cache
+import Sesion
+
+load_dotenv()
+
+# Cambios que llegan a la base por fuera de la aplicación (importaciones, scripts, otra
+# instalación) o desde otro proceso. SINCRONIZACION=auto usa change streams y, si la base
+# no los tiene (un mongod sin replica set), consulta updated_at cada SONDEO_SEGUNDOS.
+# "cambios" o "sondeo" fuerzan uno de los dos; sin definir no se vigila nada.
+MODO = os.getenv("SINCRONIZACION", "no").lower()
+SONDEO_SEGUNDOS = float(os.getenv("SINCRONIZACION_SONDEO_SEGUNDOS", "5"))
+# Cuánto se vuelve atrás en cada consulta: las inserciones llevan la hora del cliente
+# y las actualizaciones la del servidor
+MARGEN = timedelta(seconds=float(os.getenv("SINCRONIZACION_MARGEN_SEGUNDOS", "5")))
+# Más cambios que esto en una vuelta se tratan como un cambio en bloque
+LOTE = int(os.getenv("SINCRONIZACION_LOTE", "500"))
+# El token de reanudación (o la posición del sondeo) se guarda como mucho cada tantos segundos
+GUARDAR_CADA = float(os.getenv("SINCRONIZACION_GUARDAR_SEGUNDOS", "5"))
+
+# Código del servidor cuando no hay change streams, y los de un token que ya no sirve
+# (salió del oplog o es de otra base)
+SIN_CHANGE_STREAMS = 40573
+TOKEN_INVALIDO = {280, 286}
+
+meta = db["meta_sincronizacion"]
+
+_hilo = None
+
+
+def ahora():
+    # Sin zona, como devuelve pymongo las fechas
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def destinos():
+    """colección -> (etiquetas de Cache que invalida, colección de las vistas, índice de trigramas)."""
+    # Import local: los CRUD cargan flet y este módulo se importa desde main
+    from Dueño import DuenioCRUD
+    from Empleados import EmpleadoCRUD
+    from Servicios import ServicioCRUD
+
+    return {
+        "registro_duenios": (["cedulas", "datos:duenios"], "duenios", DuenioCRUD.indice),
+        "registro_mascotas": (["datos:mascotas"], None, None),
+        "registro_citas": (["datos:citas"], "citas", None),
+        "registro_empleados": (["veterinarios", "datos:empleados"], "empleados", EmpleadoCRUD.indice),
+        "registro_servicios": (["datos:servicios"], "servicios", ServicioCRUD.indice),
+    }
+
+
+class Sincronizador:
+    """Lleva cada cambio de la base a las cachés, a los índices de trigramas y a las vistas
+    abiertas de este proceso. Cada trabajador de Trabajadores.py corre el suyo."""
+
+    def __init__(self, modo: str = MODO):
+
+        self.modo = modo
+        self.destinos = destinos()
+        self.guardado = 0.0
+        self.pisos = {}
+
+    def etiquetas(self, nombre: str, doc: dict = None):
+        etiquetas = list(self.destinos[nombre][0])
+        if doc is None:
+            return etiquetas
+        if nombre == "registro_duenios" and doc.get("cedula"):
+            etiquetas.append(f"mascotas:{doc['cedula']}")
+        elif nombre == "registro_mascotas" and doc.get("duenio_id"):
+            duenio = db["registro_duenios"].find_one({"_id": doc["duenio_id"]}, {"cedula": 1})
+            if duenio:
+                etiquetas.append(f"mascotas:{duenio.get('cedula')}")
+        return etiquetas
+
+    def aplicar(self, nombre: str, operacion: str, _id, doc: dict = None):
+        # doc es el documento completo como quedó; None si ya no existe
+        _, coleccion, indice = self.destinos[nombre]
+        if coleccion is not None and Sesion.es_propio(coleccion, _id):
+            # Lo escribió una sesión de este proceso: el CRUD ya invalidó la caché y el índice,
+            # y notificar_cambio ya lo llevó a las demás pestañas
+            return
+        # Solo la caché local: cada proceso ve el cambio por su cuenta, no se vuelve a publicar en Redis
+        Cache.cache.invalidar(*self.etiquetas(nombre, doc))
+        if indice is not None:
+            indice.sincronizar(_id, doc)
+        if coleccion is not None:
+            if doc is None:
+                Sesion.aplicar_en_todas(coleccion, "eliminar", {"_id": str(_id)})
+            else:
+                Sesion.aplicar_en_todas(coleccion, operacion, {**doc, "_id": str(_id)})
+
+    def aplicar_bloque(self, nombre: str):
+        # Muchos cambios juntos (una importación): se descarta todo lo de esa colección
+        _, coleccion, indice = self.destinos[nombre]
+        Cache.cache.invalidar(*self.etiquetas(nombre))
+        if indice is not None:
+            indice.vaciar()
+        if coleccion is not None:
+            Sesion.recargar_todas(coleccion)
+
+    def guardar(self, clave: str, valor, forzar: bool = False):
+        if not forzar and time.monotonic() - self.guardado < GUARDAR_CADA:
+            return
+        self.guardado = time.monotonic()
+        try:
+            meta.update_one({"_id": clave}, {"$set": {"valor": valor, "fecha": datetime.now()}}, upsert=True)
+        except PyMongoError as e:
+            print("No se pudo guardar la posición de la sincronización:", e)
+
+    def leer(self, clave: str):
+        doc = meta.find_one({"_id": clave})
+        return doc.get("valor") if doc else None
+
+    # Change streams
+
+    def evento(self, evento: dict):
+        nombre = evento.get("ns", {}).get("coll")
+        if nombre not in self.destinos:
+            return
+        tipo = evento["operationType"]
+        if tipo in ("insert", "update", "replace", "delete"):
+            operacion = "crear" if tipo == "insert" else "actualizar"
+            self.aplicar(nombre, operacion, evento["documentKey"]["_id"], evento.get("fullDocument"))
+        else:
+            # drop, rename: lo que se tenía de esa colección ya no sirve
+            self.aplicar_bloque(nombre)
+
+    def escuchar(self):
+        """Sigue los cambios desde el último token guardado. Devuelve False si la base
+        no tiene change streams."""
+        filtro = [{"$match": {"ns.coll": {"$in": list(self.destinos)}}}]
+        token = self.leer("cambios")
+        while True:
+            try:
+                # start_after (y no resume_after) también sigue después de un evento invalidate
+                with db.watch(filtro, full_document="updateLookup", start_after=token) as flujo:
+                    print("Sincronización por change streams" + (" desde el último token" if token else ""))
+                    for evento in flujo:
+                        self.evento(evento)
+                        token = flujo.resume_token
+                        self.guardar("cambios", token)
+                    self.guardar("cambios", token, forzar=True)
+            except OperationFailure as e:
+                if e.code == SIN_CHANGE_STREAMS:
+                    return False
+                if token is not None and e.code in TOKEN_INVALIDO:
+                    # Lo que pasó mientras no se escuchaba ya no se puede saber
+                    print("El token de sincronización ya no está en el oplog; se descartan las cachés")
+                    token = None
+                    for nombre in self.destinos:
+                        self.aplicar_bloque(nombre)
+                    continue
+                print("Error en la sincronización:", e)
+                time.sleep(SONDEO_SEGUNDOS)
+            except PyMongoError as e:
+                print("Error en la sincronización:", e)
+                time.sleep(SONDEO_SEGUNDOS)
+
+    # Sondeo por updated_at
+
+    def vuelta(self, nombre: str, desde: datetime, vistos: dict):
+        """Aplica lo que cambió en la colección después de `desde` y devuelve la fecha más nueva vista."""
+        # Después de un cambio en bloque no se vuelve atrás más allá de su última fecha
+        piso = max(desde - MARGEN, self.pisos.get(nombre, datetime.min))
+        cursor = db[nombre].find({ACTUALIZADO: {"$gt": piso}}).sort(ACTUALIZADO, ASCENDING)
+        docs = list(cursor.limit(LOTE + 1))
+        if len(docs) > LOTE:
+            self.aplicar_bloque(nombre)
+            ultimo = db[nombre].find_one({}, {ACTUALIZADO: 1}, sort=[(ACTUALIZADO, DESCENDING)])
+            self.pisos[nombre] = ultimo[ACTUALIZADO]
+            return ultimo[ACTUALIZADO]
+        for doc in docs:
+            clave = (nombre, doc["_id"])
+            if vistos.get(clave) == doc[ACTUALIZADO]:
+                continue
+            vistos[clave] = doc[ACTUALIZADO]
+            # Sin change streams no se sabe si fue inserción: se deduce por la fecha del _id
+            creado = doc["_id"].generation_time.replace(tzinfo=None) > piso
+            self.aplicar(nombre, "crear" if creado else "actualizar", doc["_id"], doc)
+            desde = max(desde, doc[ACTUALIZADO])
+        return desde
+
+    def sondear(self):
+        """No ve los documentos borrados por fuera de la aplicación: esos se acotan con CACHE_TTL."""
+        print(f"Sincronización por sondeo de {ACTUALIZADO} cada {SONDEO_SEGUNDOS:g} s")
+        guardados = self.leer("sondeo") or {}
+        inicio = ahora()
+        ultimos = {nombre: guardados.get(nombre, inicio) for nombre in self.destinos}
+        vistos = {}
+        while True:
+            try:
+                for nombre in self.destinos:
+                    ultimos[nombre] = self.vuelta(nombre, ultimos[nombre], vistos)
+                # Lo que ya quedó fuera de la ventana no puede volver a aparecer
+                limite = min(ultimos.values()) - 2 * MARGEN
+                for clave in [c for c, fecha in vistos.items() if fecha < limite]:
+                    del vistos[clave]
+                self.guardar("sondeo", ultimos)
+            except PyMongoError as e:
+                print("Error en la sincronización:", e)
+            time.sleep(SONDEO_SEGUNDOS)
+
+    def correr(self):
+        if self.modo == "sondeo":
+            self.sondear()
+        elif self.escuchar() is False:
+            if self.modo == "cambios":
+                print("La base no tiene change streams (hace falta un replica set); no se sincroniza")
+                return
+            self.sondear()
+
+
+def iniciar():
+    """Arranca el hilo de sincronización si SINCRONIZACION lo pide. Se puede llamar más de una vez."""
+    global _hilo
+    if MODO not in ("auto", "cambios", "sondeo") or _hilo is not None:
+        return
+    _hilo = threading.Thread(target=lambda: Sincronizador().correr(), daemon=True, name="sincronizacion")
+    _hilo.start()
@@ -0,0 +1,130 @@
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from dotenv import load_dotenv
+from Indices import asegurar_indices
+
+load_dotenv()
+
+CARPETA = os.path.dirname(os.path.abspath(__file__))
+
+# flet corre cada sesión sobre un websocket que vive en un solo proceso,
+# por eso el proxy reparte por IP (ip_hash) y no petición por petición.
+PLANTILLA_NGINX = """worker_processes 1;
+pid {carpeta}/nginx.pid;
+error_log {carpeta}/nginx_error.log;
+
+events {{
+    worker_connections 1024;
+}}
+
+http {{
+    access_log off;
+    client_body_temp_path {carpeta}/nginx_tmp;
+    proxy_temp_path {carpeta}/nginx_tmp;
+
+    map $http_upgrade $connection_upgrade {{
+        default upgrade;
+        '' close;
+    }}
+
+    upstream veterinaria {{
+        ip_hash;
+{servidores}
+    }}
+
+    server {{
+        listen {puerto};
+
+        location / {{
+            proxy_pass http://veterinaria;
+            proxy_http_version 1.1;
+            proxy_set_header Upgrade $http_upgrade;
+            proxy_set_header Connection $connection_upgrade;
+            proxy_set_header Host $host;
+            proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+            proxy_read_timeout 86400;
+        }}
+    }}
+}}
+"""
+
+
+def configuracion_nginx(puerto: int, puertos: list[int], carpeta: str):
+    servidores = "\n".join(f"        server 127.0.0.1:{p};" for p in puertos)
+    return PLANTILLA_NGINX.format(carpeta=carpeta, puerto=puerto, servidores=servidores)
+
+
+def lanzar_trabajador(puerto: int):
+    entorno = {
+        **os.environ,
+        # Servidor web sin abrir el navegador, escuchando solo en local detrás del proxy
+        "FLET_FORCE_WEB_SERVER": "1",
+        "FLET_SERVER_IP": "127.0.0.1",
+        "FLET_SERVER_PORT": str(puerto),
+    }
+    return subprocess.Popen([sys.executable, os.path.join(CARPETA, "main.py")], env=entorno, cwd=CARPETA)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Levanta varios procesos de main.py detrás de nginx con sesiones fijas")
+    parser.add_argument("--trabajadores", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--puerto", type=int, default=int(os.getenv("PUERTO", "8550")), help="puerto público del proxy")
+    parser.add_argument("--primer-puerto", type=int, default=None, help="puerto del primer trabajador (por defecto --puerto + 1)")
+    parser.add_argument("--carpeta", default=os.path.join(CARPETA, "despliegue"), help="dónde se escribe nginx.conf y sus archivos")
+    parser.add_argument("--sin-proxy", action="store_true", help="solo genera nginx.conf y levanta los trabajadores")
+    args = parser.parse_args()
+
+    if args.trabajadores > 1 and not os.getenv("CACHE_REDIS_URL"):
+        print("Aviso: sin CACHE_REDIS_URL cada trabajador tiene su propia caché y no ve las invalidaciones de los otros "
+              "hasta que venzan (CACHE_TTL)")
+
+    primero = args.primer_puerto or args.puerto + 1
+    puertos = [primero + i for i in range(args.trabajadores)]
+    carpeta = os.path.abspath(args.carpeta)
+    os.makedirs(os.path.join(carpeta, "nginx_tmp"), exist_ok=True)
+    archivo_nginx = os.path.join(carpeta, "nginx.conf")
+    with open(archivo_nginx, "w", encoding="utf-8") as archivo:
+        archivo.write(configuracion_nginx(args.puerto, puertos, carpeta))
+    print(f"Configuración de nginx escrita en {archivo_nginx}")
+
+    # Índices y migraciones una sola vez, antes de que los trabajadores arranquen a la vez
+    asegurar_indices()
+
+    procesos = {p: lanzar_trabajador(p) for p in puertos}
+    proxy = None
+    if not args.sin_proxy:
+        nginx = shutil.which("nginx")
+        if nginx is None:
+            print("No se encontró nginx; los trabajadores quedan en los puertos", puertos)
+        else:
+            proxy = subprocess.Popen([nginx, "-p", carpeta, "-c", archivo_nginx, "-g", "daemon off;"])
+            print(f"Aplicación en http://localhost:{args.puerto}")
+
+    terminar = False
+
+    def detener(signum, frame):
+        global terminar
+        terminar = True
+
+    signal.signal(signal.SIGINT, detener)
+    signal.signal(signal.SIGTERM, detener)
+
+    # Un trabajador que se cae se vuelve a levantar; sus sesiones se reconectan solas
+    while not terminar:
+        for puerto, proceso in procesos.items():
+            if proceso.poll() is not None:
+                print(f"Trabajador en {puerto} terminó con código {proceso.returncode}; se reinicia")
+                procesos[puerto] = lanzar_trabajador(puerto)
+        time.sleep(1)
+
+    for proceso in [*procesos.values(), proxy]:
+        if proceso is not None and proceso.poll() is None:
+            proceso.terminate()
+    for proceso in [*procesos.values(), proxy]:
+        if proceso is not None:
+            proceso.wait()
@@ -0,0 +1 @@
+# Mediciones de rendimiento. Se ejecutan con python -m benchmarks.<nombre>
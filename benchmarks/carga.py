@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+import MongoDB
+from benchmarks import datos
+from benchmarks.suite import commit_actual
+from schemas import CitaBase
+from Dueño import DuenioCRUD
+from Empleados import EmpleadoCRUD
+from Servicios import ServicioCRUD
+from Citas import CitaCRUD
+
+PREFIJOS = ["an", "lu", "ma", "jo", "ca", "pe", "go", "ro", "qui", "gua"]
+
+
+def percentil(valores: list, p: float):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+class Carga:
+    """Simula N pestañas del navegador en un solo loop, como las atiende flet en WEB_BROWSER:
+    cada sesión navega por las vistas, busca dueños y agenda una cita, una y otra vez."""
+
+    def __init__(self, sesiones: int, iteraciones: int, pausa: float):
+
+        self.sesiones = sesiones
+        self.iteraciones = iteraciones
+        self.pausa = pausa
+        self.latencias = defaultdict(list)
+        self.errores = defaultdict(int)
+        self.reservas = {"creadas": 0, "choques": 0}
+
+    async def medir(self, nombre: str, corrutina):
+        inicio = time.perf_counter()
+        try:
+            return await corrutina
+        except Exception as e:
+            self.errores[f"{nombre}: {type(e).__name__}"] += 1
+        finally:
+            self.latencias[nombre].append((time.perf_counter() - inicio) * 1000)
+
+    async def reservar(self, azar: random.Random, veterinarios: list, cedulas: list):
+        # Un bloque de 30 minutos en un día hábil de las próximas semanas
+        lunes = datos.lunes_actual() + timedelta(weeks=azar.randrange(1, 8))
+        inicio = lunes + timedelta(days=azar.randrange(5), hours=8, minutes=30 * azar.randrange(15))
+        veterinario = azar.choice(veterinarios)
+        if await CitaCRUD.hay_conflicto_async(veterinario, inicio, inicio + timedelta(minutes=30)):
+            self.reservas["choques"] += 1
+            return
+        await CitaCRUD.crear_async(CitaBase(
+            fechaInicio=inicio, duenio=azar.choice(cedulas), mascota="Carga",
+            veterinario=veterinario, duracion=30,
+        ))
+        self.reservas["creadas"] += 1
+
+    async def sesion(self, numero: int, veterinarios: list, cedulas: list):
+        azar = random.Random(numero)
+        # Las sesiones no arrancan todas en el mismo instante
+        await asyncio.sleep(azar.random() * self.pausa)
+        for _ in range(self.iteraciones):
+            await self.medir("navegar.dueños", DuenioCRUD.mostrarView_async(""))
+            await self.medir("buscar.dueños", DuenioCRUD.mostrarView_async(azar.choice(PREFIJOS)))
+            await self.medir("navegar.citas", CitaCRUD.mostrarView_async("", None))
+            await self.medir("navegar.empleados", EmpleadoCRUD.mostrarView_async(""))
+            await self.medir("navegar.servicios", ServicioCRUD.mostrarView_async(""))
+            await self.medir("reservar", self.reservar(azar, veterinarios, cedulas))
+            await asyncio.sleep(azar.random() * self.pausa)
+
+    async def correr(self):
+        veterinarios = await EmpleadoCRUD.obtener_veterinarios_activos_async()
+        cedulas = await DuenioCRUD.obtener_cedulas_async()
+        if not veterinarios or not cedulas:
+            sys.exit("La base no tiene veterinarios o dueños; use --sembrar")
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*[self.sesion(n, veterinarios, cedulas) for n in range(self.sesiones)])
+        segundos = time.perf_counter() - inicio
+
+        todas = [ms for lista in self.latencias.values() for ms in lista]
+        operaciones = {
+            nombre: {
+                "n": len(lista),
+                "p50_ms": round(percentil(lista, 0.50), 2),
+                "p99_ms": round(percentil(lista, 0.99), 2),
+                "max_ms": round(max(lista), 2),
+            }
+            for nombre, lista in sorted(self.latencias.items())
+        }
+        return {
+            "segundos": round(segundos, 2),
+            "operaciones_por_segundo": round(len(todas) / segundos, 1),
+            "p50_ms": round(percentil(todas, 0.50), 2),
+            "p99_ms": round(percentil(todas, 0.99), 2),
+            "operaciones": operaciones,
+            "reservas": self.reservas,
+            "errores": dict(self.errores),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga: N sesiones simuladas contra un mongod real")
+    parser.add_argument("--sesiones", type=int, default=20)
+    parser.add_argument("--iteraciones", type=int, default=5, help="vueltas de navegación, búsqueda y reserva por sesión")
+    parser.add_argument("--pausa", type=float, default=0.5, help="segundos máximos de espera entre acciones")
+    parser.add_argument("--base", default="Veterinaria_benchmark")
+    parser.add_argument("--sembrar", action="store_true", help="borra y llena la base con benchmarks.datos antes de empezar")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="archivo JSON (por defecto se imprime)")
+    args = parser.parse_args()
+
+    # Las vistas async usan AsyncMongoClient, que mongomock no tiene
+    if not os.getenv("MONGODB_URI"):
+        sys.exit("Defina MONGODB_URI (por ejemplo mongodb://localhost:27017) para la prueba de carga")
+    MongoDB.configurar(base=args.base)
+    if args.sembrar:
+        from Indices import aplicar
+        aplicar()
+        datos.sembrar(args.semilla)
+
+    resultado = asyncio.run(Carga(args.sesiones, args.iteraciones, args.pausa).correr())
+    informe = {
+        "commit": commit_actual(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sesiones": args.sesiones,
+        "iteraciones": args.iteraciones,
+        "pausa_s": args.pausa,
+        **resultado,
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            archivo.write(texto)
+    else:
+        print(texto)
@@ -0,0 +1,149 @@
+import random
+from datetime import datetime, timedelta
+from bson import ObjectId
+from MongoDB import db
+from Busqueda import CAMPO, claves_busqueda
+from Dueño import DuenioCRUD
+from Empleados import EmpleadoCRUD
+from Citas import CitaCRUD
+from Servicios import ServicioCRUD
+
+NOMBRES = ["Ana", "Luis", "María", "José", "Carmen", "Jorge", "Lucía", "Pedro", "Sofía", "Andrés",
+           "Valeria", "Diego", "Gabriela", "Fernando", "Daniela", "Ricardo", "Paola", "Héctor"]
+APELLIDOS = ["Pérez", "Gómez", "Rodríguez", "Sánchez", "Torres", "Ramírez", "Flores", "Vega",
+             "Castro", "Morales", "Herrera", "Mendoza", "Cabrera", "Ortiz", "Salazar", "Núñez"]
+CIUDADES = ["Quito", "Guayaquil", "Cuenca", "Loja", "Ambato", "Manta", "Ibarra", "Machala"]
+ESPECIES = {"Perro": ["Labrador", "Poodle", "Beagle", "Mestizo"], "Gato": ["Siamés", "Persa", "Mestizo"]}
+MASCOTAS = ["Rex", "Luna", "Max", "Toby", "Mia", "Simba", "Coco", "Nala", "Rocky", "Kira", "Lola", "Bruno"]
+SERVICIOS = ["Vacunación", "Desparasitación", "Baño", "Consulta general", "Cirugía menor", "Radiografía"]
+
+# Cantidades por defecto: una clínica mediana con algunos años de historia
+TAMANIOS = {
+    "duenios": 2000,
+    "mascotas_por_duenio": 2,
+    "fichas_por_mascota": 3,
+    "veterinarios": 8,
+    "empleados": 20,
+    "citas": 20000,
+    "servicios": 5000,
+}
+
+LOTE = 1000
+
+
+def insertar(coleccion: str, docs: list):
+    for i in range(0, len(docs), LOTE):
+        db[coleccion].insert_many(docs[i:i + LOTE], ordered=False)
+
+
+def nombre_completo(azar: random.Random):
+    return f"{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)}"
+
+
+def lunes_actual():
+    hoy = datetime.now()
+    return datetime.combine(hoy.date() - timedelta(days=hoy.weekday()), datetime.min.time())
+
+
+def sembrar(semilla: int = 0, **tamanios):
+    """Borra las colecciones registro_* de la base configurada y las llena con datos sintéticos.
+    Con la misma semilla y los mismos tamaños se generan siempre los mismos datos."""
+    t = {**TAMANIOS, **tamanios}
+    azar = random.Random(semilla)
+
+    for nombre in ["registro_duenios", "registro_mascotas", "registro_fichas",
+                   "registro_empleados", "registro_citas", "registro_servicios"]:
+        db[nombre].delete_many({})
+
+    empleados = []
+    for i in range(t["empleados"]):
+        empleado = {
+            "rol": "Veterinario" if i < t["veterinarios"] else azar.choice(["Recepcionista", "Asistente"]),
+            "nombre": f"{nombre_completo(azar)} {i}",
+            "especialidad": azar.choice(["General", "Cirugía", "Dermatología", "Felinos"]),
+            "estado": "activo" if i < t["veterinarios"] or azar.random() < 0.8 else "fuera de servicio",
+        }
+        empleado[CAMPO] = claves_busqueda(empleado, EmpleadoCRUD.campos_busqueda)
+        empleados.append(empleado)
+    insertar("registro_empleados", empleados)
+    veterinarios = [e["nombre"] for e in empleados[:t["veterinarios"]]]
+
+    duenios, mascotas, fichas = [], [], []
+    for i in range(t["duenios"]):
+        duenio = {
+            "_id": ObjectId(),
+            "cedula": f"09{i:08d}",
+            "nombre": nombre_completo(azar),
+            "gmail": f"duenio{i}@correo.com",
+            "telefono": f"09{azar.randrange(10 ** 8):08d}",
+            "direccion": f"{azar.choice(CIUDADES)}, calle {azar.randrange(1, 200)}",
+            "mascotas": [],
+        }
+        duenio[CAMPO] = claves_busqueda(duenio, DuenioCRUD.campos_busqueda)
+        for _ in range(t["mascotas_por_duenio"]):
+            especie = azar.choice(list(ESPECIES))
+            mascota = {
+                "_id": ObjectId(),
+                "nombre": azar.choice(MASCOTAS),
+                "especie": especie,
+                "raza": azar.choice(ESPECIES[especie]),
+                "sexo": azar.choice(["Macho", "Hembra"]),
+                "peso": round(azar.uniform(2, 40), 1),
+                "fecha_nacimiento": (datetime(2015, 1, 1) + timedelta(days=azar.randrange(3000))).date().isoformat(),
+                "duenio_id": duenio["_id"],
+            }
+            duenio["mascotas"].append({"_id": mascota["_id"], "nombre": mascota["nombre"]})
+            for _ in range(t["fichas_por_mascota"]):
+                fichas.append({
+                    "mascota_id": mascota["_id"],
+                    "fecha": datetime(2020, 1, 1) + timedelta(days=azar.randrange(2000)),
+                    "diagnostico": "Control de rutina sin novedades",
+                    "tratamiento": "Ninguno, revisión en seis meses",
+                    "examen": "Examen físico general",
+                })
+            mascotas.append(mascota)
+        duenios.append(duenio)
+    insertar("registro_duenios", duenios)
+    insertar("registro_mascotas", mascotas)
+    insertar("registro_fichas", fichas)
+
+    # Citas repartidas en las semanas alrededor de la actual, en bloques de 30 minutos de 8:00 a 16:00
+    semanas = max(1, t["citas"] // max(1, len(veterinarios) * 5 * 16))
+    inicio = lunes_actual() - timedelta(weeks=semanas // 2)
+    citas = []
+    for _ in range(t["citas"]):
+        duenio = azar.choice(duenios)
+        fecha = inicio + timedelta(
+            weeks=azar.randrange(semanas), days=azar.randrange(5), hours=8, minutes=30 * azar.randrange(16)
+        )
+        cita = {
+            "fechaInicio": fecha,
+            "fechaFin": fecha + timedelta(minutes=30),
+            "duenio": str(duenio["_id"]),
+            "mascota": str(azar.choice(duenio["mascotas"])["_id"]) if duenio["mascotas"] else "",
+            "veterinario": azar.choice(veterinarios),
+            "duracion": 30,
+            "estado": azar.choice(["ausente", "asistió"]),
+        }
+        cita[CAMPO] = claves_busqueda(cita, CitaCRUD.campos_busqueda)
+        citas.append(cita)
+    insertar("registro_citas", citas)
+
+    servicios = []
+    for _ in range(t["servicios"]):
+        servicio = {
+            "nombre": azar.choice(SERVICIOS),
+            "descripcion": "Servicio registrado en la cita",
+            "veterinario": azar.choice(veterinarios),
+            "duenio": azar.choice(duenios)["cedula"],
+            "pago": round(azar.uniform(5, 150), 2),
+        }
+        servicio[CAMPO] = claves_busqueda(servicio, ServicioCRUD.campos_busqueda)
+        servicios.append(servicio)
+    insertar("registro_servicios", servicios)
+
+    return {
+        "duenios": len(duenios), "mascotas": len(mascotas), "fichas": len(fichas),
+        "empleados": len(empleados), "citas": len(citas), "servicios": len(servicios),
+        "veterinarios": veterinarios,
+    }
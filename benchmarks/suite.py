@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+import MongoDB
+from benchmarks import datos
+from Dueño import DuenioCRUD
+from Empleados import EmpleadoCRUD
+from Servicios import ServicioCRUD
+from Citas import CitaCRUD
+from Indices import aplicar
+from plantilla import crear_tabla_manual
+
+
+def commit_actual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def preparar_motor(motor: str, base: str):
+    """mongo usa MONGODB_URI (o Atlas) sobre una base aparte; mongomock corre en memoria."""
+    if motor == "mongomock":
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock no está instalado: pip install mongomock, o use --motor mongo")
+        MongoDB.configurar(cliente=mongomock.MongoClient(), base=base)
+    else:
+        MongoDB.configurar(base=base)
+
+
+def medir(funcion, repeticiones: int, calentamiento: int = 1):
+    for _ in range(calentamiento):
+        funcion()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {
+        "repeticiones": repeticiones,
+        "min_ms": round(tiempos[0], 3),
+        "mediana_ms": round(statistics.median(tiempos), 3),
+        "p95_ms": round(tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))], 3),
+    }
+
+
+def casos(sembrado: dict):
+    veterinario = sembrado["veterinarios"][0]
+    martes = datos.lunes_actual() + timedelta(days=1, hours=10)
+    filas = [
+        {"_id": str(i), "nombre": f"Fila {i}", "cedula": f"09{i:08d}", "telefono": "0999999999", "direccion": "Quito"}
+        for i in range(1000)
+    ]
+
+    return {
+        "duenios.buscar_vacio": lambda: DuenioCRUD.buscar(""),
+        "duenios.buscar_prefijo": lambda: DuenioCRUD.buscar("an"),
+        "duenios.buscar_dos_palabras": lambda: DuenioCRUD.buscar("ana quito"),
+        "duenios.buscar_siguiente_pagina": lambda: DuenioCRUD.buscar("an", DuenioCRUD.buscar("an")[1]),
+        "duenios.indice_trigramas": lambda: DuenioCRUD.indice.buscar("ana"),
+        "empleados.buscar": lambda: EmpleadoCRUD.buscar("veterinario"),
+        "servicios.buscar": lambda: ServicioCRUD.buscar("vacunacion"),
+        "citas.buscar": lambda: CitaCRUD.buscar("asistio"),
+        "citas.buscar_semana": lambda: CitaCRUD.buscar_semana(veterinario, datos.lunes_actual()),
+        "citas.mostrarView": lambda: CitaCRUD.mostrarView(""),
+        "citas.hay_conflicto": lambda: CitaCRUD.hay_conflicto(veterinario, martes, martes + timedelta(minutes=30)),
+        "plantilla.tabla_virtual_1000": lambda: crear_tabla_manual([dict(f) for f in filas], print),
+        "plantilla.tabla_completa_1000": lambda: crear_tabla_manual([dict(f) for f in filas], print, virtual=False),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mide los puntos de entrada de los CRUD sobre datos sintéticos")
+    parser.add_argument("--motor", choices=["mongo", "mongomock"],
+                        default="mongo" if os.getenv("MONGODB_URI") else "mongomock")
+    parser.add_argument("--base", default="Veterinaria_benchmark", help="base que se borra y se vuelve a llenar")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--filtro", default="", help="solo los casos cuyo nombre contiene este texto")
+    parser.add_argument("--salida", help="archivo JSON (por defecto se imprime)")
+    for nombre, valor in datos.TAMANIOS.items():
+        parser.add_argument(f"--{nombre}", type=int, default=valor)
+    args = parser.parse_args()
+
+    # Las colecciones de los CRUD se resuelven al primer uso, así que alcanza con configurar antes
+    preparar_motor(args.motor, args.base)
+    aplicar()
+
+    tamanios = {nombre: getattr(args, nombre) for nombre in datos.TAMANIOS}
+    inicio = time.perf_counter()
+    sembrado = datos.sembrar(args.semilla, **tamanios)
+    segundos_sembrado = round(time.perf_counter() - inicio, 2)
+
+    resultados = {}
+    for nombre, funcion in casos(sembrado).items():
+        if args.filtro in nombre:
+            resultados[nombre] = medir(funcion, args.repeticiones)
+            print(f"{nombre:<32} {resultados[nombre]['mediana_ms']:>10.3f} ms", file=sys.stderr)
+
+    informe = {
+        "commit": commit_actual(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "motor": args.motor,
+        "semilla": args.semilla,
+        "tamanios": tamanios,
+        "documentos": {k: v for k, v in sembrado.items() if k != "veterinarios"},
+        "sembrado_s": segundos_sembrado,
+        "resultados": resultados,
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            archivo.write(texto)
+    else:
+        print(texto)
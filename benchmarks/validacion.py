@@ -0,0 +1,71 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from pydantic import ValidationError
+from schemas import CitaBase, DuenioBase, validar_lote
+
+
+def filas_citas(n: int):
+    lunes = datetime(2025, 1, 6, 8, 0)
+    return [
+        {
+            "fechaInicio": (lunes + timedelta(days=i % 5, minutes=30 * (i % 14))).isoformat(),
+            "duenio": f"09{i:08d}",
+            "mascota": f"Mascota {i}",
+            "veterinario": "Dra. Ruiz",
+            "duracion": 30,
+        }
+        for i in range(n)
+    ]
+
+
+def filas_duenios(n: int):
+    return [
+        {
+            "cedula": f"09{i:08d}",
+            "nombre": f"Dueño {i}",
+            "gmail": f"duenio{i}@correo.com",
+            "telefono": f"09{i:08d}",
+            "direccion": "Av. Siempre Viva",
+        }
+        for i in range(n)
+    ]
+
+
+def uno_a_uno(modelo, filas):
+    validos, errores = [], []
+    for i, fila in enumerate(filas):
+        try:
+            validos.append((i, modelo(**fila)))
+        except ValidationError as e:
+            errores.append((i, e.errors()))
+    return validos, errores
+
+
+def medir(funcion, modelo, filas, repeticiones: int):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(modelo, filas)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return len(filas) / mejor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara validar uno a uno contra validar_lote")
+    parser.add_argument("-n", type=int, default=20000, help="filas por modelo")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--invalidas", type=float, default=0.002, help="fracción de filas con error")
+    args = parser.parse_args()
+
+    for modelo, generar in [(CitaBase, filas_citas), (DuenioBase, filas_duenios)]:
+        filas = generar(args.n)
+        # Algunas filas rotas para que también se mida el camino con errores
+        if args.invalidas:
+            for i in random.Random(0).sample(range(len(filas)), int(len(filas) * args.invalidas)):
+                filas[i] = {**filas[i], "cedula": "x", "duracion": 5}
+
+        simple = medir(uno_a_uno, modelo, filas, args.repeticiones)
+        lote = medir(validar_lote, modelo, filas, args.repeticiones)
+        print(f"{modelo.__name__:<12} uno a uno: {simple:>10,.0f} filas/s   lote: {lote:>10,.0f} filas/s   ({lote / simple:.2f}x)")
@@ -1,11 +1,16 @@
 import asyncio
-from datetime import time
 import flet as ft
 import threading
 from Dueño import DuenioCRUD
 from Citas import CitaCRUD
 from Empleados import EmpleadoCRUD
 from Servicios import ServicioCRUD
+from Indices import asegurar_indices, asegurar_migraciones
+import Cache
+import Instrumentacion
+from Instrumentacion import accion
+import Sesion
+import Sincronizacion
 
 
 class Destino:
@@ -143,60 +148,89 @@ class LeftNavigationMenu(ft.Column):
         self.page.update()
 
 
-debounce_timer = None
+# Segundos sin escribir antes de lanzar la búsqueda
+RETRASO_BUSQUEDA = 0.5
 
 
-def main(page: ft.Page):
+async def main(page: ft.Page):
     page.window.icon = (
         r"C:\\Users\\user\\Desktop\\Proy\\veterinaria\\src\\assets\\icon.png"
     )
     page.theme = ft.Theme(color_scheme_seed="lightblue")
     page.title = "Veterinaria Huellitas"
+    sesion = Sesion.abrir(page)
 
-    async def recargar_vista():
-        await asyncio.sleep(1)
-        nuevo_contenido = get_page_content(mostrar["actual"])
-        nuevo_contenido.key = str(time())
-        content_area.content.controls[1] = nuevo_contenido
+    def mostrar_contenido(contenido):
+        content_area.content.controls[1] = contenido
+        sesion.contenido = contenido
+        sesion.coleccion = colecciones.get(sesion.vista)
+        sesion.clave = (sesion.vista, sesion.busqueda)
         page.update()
 
+    async def recargar_vista():
+        # Solo cuando un cambio no se pudo aplicar sobre la vista abierta.
+        # Si mientras tanto se buscó o se cambió de vista, gana eso.
+        secuencia = sesion.secuencia
+        contenido = await get_page_content(sesion.vista)
+        if sesion.vigente(secuencia):
+            mostrar_contenido(contenido)
+
+    sesion.recargar = lambda: page.run_task(recargar_vista)
 
     crear = {
         "dueños": lambda: DuenioCRUD.crearView(page),
         "empleados": lambda: EmpleadoCRUD.crearView(page),
-        "citas": lambda: CitaCRUD.crearView(page),
+        "citas": lambda: CitaCRUD.crearView_async(page),
     }
+    # Las vistas se arman con la capa async para no bloquear la sesión mientras llegan los datos
     mostrar = {
-        "dueños": lambda b: DuenioCRUD.mostrarView(b),
-        "citas": lambda b: CitaCRUD.mostrarView(b, page),
-        "empleados": lambda b: EmpleadoCRUD.mostrarView(b),
-        "servicios": lambda b: ServicioCRUD.mostrarView(b),
-        "actual": "dueños",
-        "busqueda": "",
+        "dueños": lambda b: DuenioCRUD.mostrarView_async(b),
+        "citas": lambda b: CitaCRUD.mostrarView_async(b, page),
+        "empleados": lambda b: EmpleadoCRUD.mostrarView_async(b),
+        "servicios": lambda b: ServicioCRUD.mostrarView_async(b),
+    }
+    # Colección que muestra cada vista, para aplicarle los cambios de los CRUD
+    colecciones = {"dueños": "duenios", "citas": "citas", "empleados": "empleados", "servicios": "servicios"}
+    # Todo lo que cada vista lee: si cambia algo de esto, la vista guardada ya no sirve
+    dependencias = {
+        "dueños": ["datos:duenios"],
+        "citas": ["datos:citas", "datos:empleados", "datos:duenios", "datos:mascotas"],
+        "empleados": ["datos:empleados"],
+        "servicios": ["datos:servicios", "datos:duenios"],
     }
 
-    def get_page_content(nombre):
-        mostrar["actual"] = nombre
+    async def get_page_content(nombre):
+        sesion.vista = nombre
         print(f"Accediendo a la página: {nombre}")
         if nombre in mostrar.keys():
-            print(f"Busqueda actual: {mostrar['busqueda']}")
-            return mostrar[nombre](mostrar["busqueda"])
+            print(f"Busqueda actual: {sesion.busqueda}")
+            clave = (nombre, sesion.busqueda)
+            sellos = Cache.sellos(*dependencias[nombre])
+            contenido = sesion.vista_guardada(clave, sellos)
+            if contenido is None:
+                with accion(f"buscar en {nombre}" if sesion.busqueda else f"abrir {nombre}"):
+                    contenido = await mostrar[nombre](sesion.busqueda)
+                sesion.guardar_vista(clave, dependencias[nombre], sellos, contenido)
+            return contenido
         else:
             return ft.Text(f"Página de {nombre}", size=25)
 
-    def AbrirCrearPestaña(pagina):
+    async def AbrirCrearPestaña(pagina):
 
         tieneCrear = crear.get(pagina, None)
 
         if tieneCrear is None:
             return
-        crear[pagina]()
+        with accion(f"abrir formulario de {pagina}"):
+            resultado = crear[pagina]()
+            if asyncio.iscoroutine(resultado):
+                await resultado
 
     page.floating_action_button = ft.FloatingActionButton(
         content=ft.Icon(ft.Icons.ADD, color=ft.Colors.ON_PRIMARY),
         bgcolor=ft.Colors.PRIMARY,
         tooltip="Agregar nuevo elemento",
-        on_click=lambda e: AbrirCrearPestaña(mostrar["actual"]),
+        on_click=lambda e: page.run_task(AbrirCrearPestaña, sesion.vista),
     )
 
     class Gallery:
@@ -206,25 +240,22 @@ def main(page: ft.Page):
     gallery = Gallery()
     navigation = LeftNavigationMenu(gallery=gallery)
 
-    def actualizar_busqueda(e):
-        global debounce_timer
-
-        def hacer_busqueda():
-            mostrar["busqueda"] = e.control.value
-            contenido_actualizado = get_page_content(mostrar["actual"])
-            content_area.content.controls[1] = contenido_actualizado
-            page.update()
-
-        if debounce_timer:
-            debounce_timer.cancel()
+    # La búsqueda es de la sesión: escribir en una pestaña no cancela la de otra
+    async def buscar_con_retraso(texto, secuencia):
+        await asyncio.sleep(RETRASO_BUSQUEDA)
+        sesion.busqueda = texto
+        contenido_actualizado = await get_page_content(sesion.vista)
+        if not sesion.vigente(secuencia):
+            return
+        mostrar_contenido(contenido_actualizado)
 
-        # Espera 0.3 segundos después de dejar de escribir
-        debounce_timer = threading.Timer(0.5, hacer_busqueda)
-        debounce_timer.start()
+    async def actualizar_busqueda(e):
+        secuencia = sesion.cancelar_busqueda()
+        sesion.tarea_busqueda = asyncio.create_task(buscar_con_retraso(e.control.value, secuencia))
 
     busqueda_input = ft.TextField(
-        value=mostrar["busqueda"],
-        on_change=lambda e: actualizar_busqueda(e),
+        value=sesion.busqueda,
+        on_change=actualizar_busqueda,
         border_radius=100,
         border_color=ft.Colors.INVERSE_PRIMARY,
         prefix_icon=ft.Icons.SEARCH,
@@ -234,21 +265,30 @@ def main(page: ft.Page):
 
     content_area = ft.Container(
         content=ft.Column(
-            [tf, get_page_content("dueños")],
+            [tf, await get_page_content("dueños")],
             horizontal_alignment=ft.CrossAxisAlignment.CENTER
         ),
         expand=True,
         padding=10,
     )
 
-    def route_change(e):
+    async def route_change(e):
         ruta = page.route.strip("/")
         destino = next((d for d in destinos if d.name == ruta), None)
         if destino:
-            mostrar["actual"] = destino.name
-            content_area.content.controls[1] = get_page_content(destino.name)
-
-            page.update()
+            # Una búsqueda pendiente de la vista anterior no debe pisar la nueva,
+            # ni una navegación anterior más lenta que termine después que esta
+            secuencia = sesion.cancelar_busqueda()
+            sesion.vista = destino.name
+            contenido = await get_page_content(destino.name)
+            if not sesion.vigente(secuencia):
+                return
+            mostrar_contenido(contenido)
+        elif ruta == "diagnostico":
+            # Resumen de consultas por acción; se abre escribiendo /diagnostico en la URL
+            sesion.cancelar_busqueda()
+            sesion.vista = ruta
+            mostrar_contenido(Instrumentacion.mostrarView())
 
     page.on_route_change = route_change
 
@@ -266,4 +306,9 @@ def main(page: ft.Page):
     page.go("/dueños")
 
 
+# Las migraciones pendientes se corren antes de abrir la app; los índices se revisan
+# en segundo plano para no retrasar la primera pantalla
+asegurar_migraciones()
+threading.Thread(target=asegurar_indices, daemon=True).start()
+Sincronizacion.iniciar()
 ft.app(target=main, view=ft.AppView.WEB_BROWSER)
@@ -1,49 +1,45 @@
 import flet as ft
 from flet import Colors
 
-def crear_tabla_manual(datos: list[object], on_click, excluir_campos=[]):
+FILAS_POR_LOTE = 20
+ALTO_FILA = 60
+
+
+def crear_tabla_manual(datos: list[object], on_click, excluir_campos=[], token=None, cargar_mas=None, por_lotes=True,
+                       filtro=None):
+    """Los datos llegan en el orden en que se muestran (más nuevos primero).
+    Si se pasa cargar_mas(token) -> (datos, token), la tabla pide la página siguiente
+    con el botón "Cargar más" o al llegar al final del scroll.
+
+    Con por_lotes las filas van en un ListView de alto fijo y sus controles se crean de a
+    FILAS_POR_LOTE a medida que se hace scroll: la vista abre rápido, pero es carga
+    incremental, no una ventana fija. Las filas ya creadas no se quitan, así que una lista
+    muy larga recorrida hasta el final queda entera en el navegador.
+
+    tabla.data queda con aplicar_cambio(operacion, doc), que inserta, reemplaza o quita una
+    sola fila después de crear, actualizar o eliminar. filtro(doc) dice si el documento
+    entra en la vista (por ejemplo, si coincide con la búsqueda). Devuelve False cuando
+    el cambio no se puede aplicar en el lugar y hay que volver a armar la vista."""
     color_linea = Colors.PRIMARY_CONTAINER
     color_cabecera = Colors.INVERSE_PRIMARY
     color_cabecera_texto = Colors.PRIMARY
-    lista_ids = [d['_id'] for d in datos[::-1]]
 
     excluir = ["_id"]
     excluir.extend(excluir_campos)
 
-    for dict in datos:
-        for campo in excluir:
-            if campo in dict:
-                del dict[campo]
-
-
     if not datos:
         return ft.Text("No hay datos para mostrar.", text_align=ft.TextAlign.CENTER, weight=ft.FontWeight.BOLD, size=16)
 
-
-    campos = list(datos[0].keys())
-    header = ft.Container(
-        content=ft.Row(
-            [ft.Text(c.replace("_", " ").capitalize(), color=color_cabecera_texto, expand=1, weight=ft.FontWeight.BOLD, size=16, text_align=ft.TextAlign.CENTER) for c in campos],
-            spacing=0,
-            width=1000, 
-        ),
-        width=1000,
-        height=60,
-        bgcolor=color_cabecera,
-        border_radius=8,
-        padding=ft.padding.symmetric(0,30),
-    )
-
-    filas = []
-    for idx, fila in enumerate(datos[::-1]):
-        valores = list(fila.values())
-        fila_cont = ft.Container(
+    def crear_fila(fila):
+        _id = fila.get("_id")
+        fila_control = ft.Container(
             content=ft.Row(
-                [ft.Text(str(v), expand=1, text_align=ft.TextAlign.CENTER) for v in valores],
+                # Un documento al que le falta un campo deja la celda vacía en vez de correr las columnas
+                [ft.Text(str(fila.get(c, "")), expand=1, text_align=ft.TextAlign.CENTER) for c in campos],
                 spacing=0
             ),
             width=1000,
-            height=60,
+            height=ALTO_FILA,
             padding=ft.padding.symmetric(0, 30),
             # Sin bgcolor fijo
             border=ft.border.Border(
@@ -52,11 +48,101 @@ def crear_tabla_manual(datos: list[object], on_click, excluir_campos=[]):
             # Efecto clic: fondo redondeado momentáneo
             ink=True,
             border_radius=8,
-            on_click=lambda e, i=idx: on_click(e, lista_ids[i])
+            on_click=lambda e, i=_id: on_click(e, i)
         )
-        filas.append(fila_cont)
+        filas[_id] = fila_control
+        return fila_control
+
+    campos = [c for c in datos[0].keys() if c not in excluir]
+    # Filas que ya tienen control, por _id
+    filas = {}
+    header = ft.Container(
+        content=ft.Row(
+            [ft.Text(c.replace("_", " ").capitalize(), color=color_cabecera_texto, expand=1, weight=ft.FontWeight.BOLD, size=16, text_align=ft.TextAlign.CENTER) for c in campos],
+            spacing=0,
+            width=1000, 
+        ),
+        width=1000,
+        height=60,
+        bgcolor=color_cabecera,
+        border_radius=8,
+        padding=ft.padding.symmetric(0,30),
+    )
 
-    return ft.Column([header, *filas], spacing=2, scroll=ft.ScrollMode.AUTO, height=500)
+    # Filas que ya se trajeron de la base pero todavía no tienen control
+    pendientes = list(datos)
+    estado = {"token": token if cargar_mas else None, "cargando": False}
+
+    def siguientes_filas():
+        if not pendientes and estado["token"] is not None:
+            nuevos, estado["token"] = cargar_mas(estado["token"])
+            pendientes.extend(nuevos)
+        n = FILAS_POR_LOTE if por_lotes else len(pendientes)
+        lote = pendientes[:n]
+        del pendientes[:n]
+        return [crear_fila(fila) for fila in lote]
+
+    def hay_mas():
+        return bool(pendientes) or estado["token"] is not None
+
+    if por_lotes:
+        cuerpo = ft.ListView(siguientes_filas(), spacing=2, item_extent=ALTO_FILA + 2, height=440)
+        tabla = ft.Column([header, cuerpo], spacing=2, width=1000)
+    else:
+        cuerpo = tabla = ft.Column([header, *siguientes_filas()], spacing=2, scroll=ft.ScrollMode.AUTO, height=500)
+
+    def quitar_fila(_id):
+        control = filas.pop(_id, None)
+        if control is not None:
+            cuerpo.controls.remove(control)
+        pendientes[:] = [f for f in pendientes if f.get("_id") != _id]
+
+    def aplicar_cambio(operacion: str, doc: dict):
+        _id = doc["_id"]
+        if operacion == "eliminar" or (filtro is not None and not filtro(doc)):
+            quitar_fila(_id)
+        elif _id in filas:
+            posicion = cuerpo.controls.index(filas[_id])
+            cuerpo.controls[posicion] = crear_fila(doc)
+        elif any(f.get("_id") == _id for f in pendientes):
+            pendientes[:] = [doc if f.get("_id") == _id else f for f in pendientes]
+        elif filtro is not None:
+            # Un documento que no estaba en la búsqueda y ahora entra: su lugar depende del puntaje
+            return False
+        elif operacion == "crear":
+            # Lo nuevo va primero, igual que en el listado; sin por_lotes la cabecera ocupa el 0
+            cuerpo.controls.insert(0 if por_lotes else 1, crear_fila(doc))
+        # Si no, es una fila de una página que todavía no se pidió: llegará actualizada
+        if cuerpo.page:
+            cuerpo.update()
+        return True
+
+    tabla.data = aplicar_cambio
+
+    if not hay_mas():
+        return tabla
+
+    def mostrar_mas(e=None):
+        if estado["cargando"] or not hay_mas():
+            return
+        estado["cargando"] = True
+        try:
+            # El botón siempre queda al final
+            cuerpo.controls[-1:-1] = siguientes_filas()
+            boton.visible = hay_mas()
+            cuerpo.update()
+        finally:
+            estado["cargando"] = False
+
+    def al_desplazar(e: ft.OnScrollEvent):
+        if e.pixels >= e.max_scroll_extent - 2 * ALTO_FILA:
+            mostrar_mas()
+
+    boton = ft.TextButton("Cargar más", icon=ft.Icons.EXPAND_MORE, on_click=mostrar_mas)
+    cuerpo.controls.append(ft.Row([boton], alignment=ft.MainAxisAlignment.CENTER, width=1000, height=ALTO_FILA))
+    cuerpo.on_scroll = al_desplazar
+    cuerpo.on_scroll_interval = 100
+    return tabla
 
 
 def mostrar_dialogo_eliminar(page: ft.Page, on_confirm):
@@ -1,10 +1,15 @@
 from pydantic import BaseModel, EmailStr, Field, field_validator
-from typing import List, Optional
+from typing import Annotated, List, Optional
 from bson import ObjectId
 from datetime import time, timedelta, datetime,date
 from bson import ObjectId
 from pydantic_core import core_schema
-from pydantic import GetCoreSchemaHandler
+from pydantic import GetCoreSchemaHandler, TypeAdapter, ValidationError, WrapValidator
+from functools import lru_cache
+
+# Horario de atención de la clínica
+HORA_MIN = time(8, 0)
+HORA_MAX = time(16, 0)
 
 class PyObjectId(ObjectId):
     @classmethod
@@ -31,7 +36,6 @@ class MascotaBase(BaseModel):
     sexo: str = Field(..., pattern=r"^(Macho|Hembra)$")
     peso: float = Field(..., ge=0)
     fecha_nacimiento: date
-    fichas: List[FichaRapida] = []
 
     @field_validator("fecha_nacimiento")
     def validar_fecha_nacimiento(cls, v: date):
@@ -45,7 +49,6 @@ class MascotaUpdate(BaseModel):
     sexo: Optional[str] = Field(None, pattern=r"^(Macho|Hembra)$")
     peso: Optional[float] = Field(None, ge=0)
     fecha_nacimiento: Optional[date]
-    fichas: Optional[List[FichaRapida]]
 
 
 class DuenioBase(BaseModel):
@@ -81,15 +84,12 @@ class CitaBase(BaseModel):
         duracion = info.data.get("duracion_minutos", 0)
         hora_inicio = fechaInicio.time()
 
-        hora_min = time(8, 0)
-        hora_max = time(16, 0)
-
         fin = (fechaInicio + timedelta(minutes=duracion)).time()
 
-        if hora_inicio < hora_min:
+        if hora_inicio < HORA_MIN:
             raise ValueError("La hora de inicio debe ser después de las 8:00 AM")
 
-        if fin > hora_max:
+        if fin > HORA_MAX:
             raise ValueError("La cita no puede extenderse más allá de las 4:00 PM")
 
         return fechaInicio
@@ -100,7 +100,7 @@ class CitaBase(BaseModel):
         return v
 
 class CitaUpdate(BaseModel):
-    fechaInicio: Optional[datetime]
+    fechaInicio: Optional[datetime] = None
     veterinario: Optional[str] = Field(None, max_length=100)
     estado: Optional[str] = Field(None, max_length=50)
 
@@ -140,4 +140,54 @@ class ServicioBase(BaseModel):
     descripcion: str = Field(..., min_length=4, max_length=300)
     veterinario: str = Field(..., max_length=100)
     duenio: str = Field(..., max_length=100)
-    pago: float = Field(..., ge=0)
\ No newline at end of file
+    pago: float = Field(..., ge=0)
+
+
+# Filas que se validan juntas. Si un sublote tiene errores, solo ese se vuelve a validar
+SUBLOTE = 100
+
+
+class _Fallo:
+    __slots__ = ("errores",)
+
+    def __init__(self, errores):
+        self.errores = errores
+
+
+def _atrapar(valor, handler):
+    try:
+        return handler(valor)
+    except ValidationError as e:
+        return _Fallo(e.errors())
+
+
+@lru_cache(maxsize=None)
+def _adaptadores(modelo):
+    # Construir un TypeAdapter es caro; se arman una sola vez por modelo.
+    # El primero valida la lista completa sin pasar por Python; el segundo
+    # devuelve el error de cada fila en vez de cortar en la primera.
+    return (
+        TypeAdapter(List[modelo]),
+        TypeAdapter(List[Annotated[modelo, WrapValidator(_atrapar)]]),
+    )
+
+
+def validar_lote(modelo, filas: list[dict]):
+    """Valida una lista de dicts contra `modelo` (por ejemplo CitaBase).
+
+    Devuelve (validos, errores): validos es una lista de (indice, instancia) y errores una
+    lista de (indice, errores de pydantic) con el índice de la fila dentro de `filas`."""
+    rapido, por_fila = _adaptadores(modelo)
+    validos, errores = [], []
+    for inicio in range(0, len(filas), SUBLOTE):
+        parte = filas[inicio:inicio + SUBLOTE]
+        try:
+            resultado = rapido.validate_python(parte)
+        except ValidationError:
+            resultado = por_fila.validate_python(parte)
+        for indice, item in enumerate(resultado, start=inicio):
+            if isinstance(item, _Fallo):
+                errores.append((indice, item.errores))
+            else:
+                validos.append((indice, item))
+    return validos, errores